@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+
+import frontend
+import server
+from compiler import init_worker
+
+
+class CompileService:
+    """asyncio front end that feeds a bounded pool of compiler processes.
+
+    Requests wait in a queue of at most `queue_size` jobs.  When it is full,
+    connections are simply not read any further, so clients feel
+    backpressure instead of the service growing without bound.  At most
+    `jobs` compiles run at once, and each one is answered (tagged with the
+    request's "id") as soon as it finishes or its `timeout` runs out.
+    """
+
+    def __init__(self, jobs=os.cpu_count(), queue_size=256, timeout=30.0):
+        self.jobs = jobs
+        self.timeout = timeout
+        self.queue = asyncio.Queue(queue_size)
+        self.pool = None
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'in_flight': self.in_flight,
+                'completed': self.completed, 'timeouts': self.timeouts}
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request, reply, done = await self.queue.get()
+            self.in_flight += 1
+            future = loop.run_in_executor(self.pool, server.handle_request, request)
+            try:
+                response = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                response = {'asm': None, 'error': f'timed out after {self.timeout}s', 'diagnostics': []}
+            except Exception as e:
+                response = {'asm': None, 'error': str(e), 'diagnostics': []}
+            await reply(request, response)
+            # a timed out compile still occupies its process; keep counting
+            # it as in flight until it is really done
+            try:
+                await future
+            except Exception:
+                pass
+            self.in_flight -= 1
+            self.completed += 1
+            done.set_result(None)
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        pending = []
+
+        async def reply(request, response):
+            if 'id' in request:
+                response['id'] = request['id']
+            async with write_lock:
+                try:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+                except ConnectionError:
+                    # the client went away; its remaining answers are dropped
+                    pass
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError(f'expected a JSON object, got {type(request).__name__}')
+                except ValueError as e:
+                    await reply({}, {'asm': None, 'error': f'bad request: {e}', 'diagnostics': []})
+                    continue
+                if request.get('op') == 'stats':
+                    await reply(request, self.stats())
+                    continue
+                done = loop.create_future()
+                pending.append(done)
+                await self.queue.put((request, reply, done))
+            # answer everything this client sent before hanging up
+            await asyncio.gather(*pending)
+        except (ConnectionError, asyncio.CancelledError):
+            # client reset, or the service is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, host=None, port=None):
+        frontend.warm_up()
+        # the pool starts workers on demand; forking them from this process
+        # would hand every open client connection to the children, so they
+        # come from a clean forkserver and warm up there instead
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['frontend', 'server'])
+        self.pool = ProcessPoolExecutor(self.jobs, mp_context=context,
+                                        initializer=init_worker, initargs=(frontend.production,))
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.jobs)]
+        if port is not None:
+            listener = await asyncio.start_server(self.handle_connection, host or '127.0.0.1', port)
+        else:
+            path = path or server.default_socket()
+            server.remove_stale_socket(path)
+            listener = await asyncio.start_unix_server(self.handle_connection, path)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for w in workers:
+                w.cancel()
+            self.pool.shutdown(cancel_futures=True)
+            if port is None:
+                os.unlink(path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='asyncio C to MIPS compile service')
+    arg_parser.add_argument('--socket', metavar='PATH', help='Unix socket to listen on')
+    arg_parser.add_argument('--port', type=int, help='listen on this TCP port instead of a Unix socket')
+    arg_parser.add_argument('--host', default='127.0.0.1', help='TCP address (default: %(default)s)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                            help='compiles in flight at once (default: %(default)s)')
+    arg_parser.add_argument('--queue', type=int, default=256, help='queued requests before backpressure')
+    arg_parser.add_argument('--timeout', type=float, default=30.0, help='seconds per compile')
+    arg_parser.add_argument('--production', action='store_true',
+                            help='trust the cached parse tables and skip grammar validation')
+    args = arg_parser.parse_args()
+    if args.production:
+        frontend.production = True
+    service = CompileService(args.jobs, args.queue, args.timeout)
+    try:
+        asyncio.run(service.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -1,4 +1,10 @@
 import datetime
+import hashlib
+import tempfile
+import types
+
+import nodes
+from cache import MemoryCache
 
 registers = {
     't0': 0, 't1': 0, 't2': 0, 't3': 0, 't4': 0, 't5': 0, 't6': 0, 't7': 0,
@@ -19,249 +25,265 @@ all_registers = {
 }
 
 
-def alloc_reg():
-    for reg in registers:
-        if registers[reg] == 0:
-            registers[reg] = 1
-            return reg
-    raise Exception('Not enough register')
+def is_reg(r):
+    return r in all_registers
 
 
-def dealloc_reg(r):
-    if r not in registers:
-        if r not in all_registers:
-            raise Exception(r + ' is not register!')
-    else:
-        registers[r] = 0
+def is_tree(x):
+    return isinstance(x, (nodes.Node, list))
 
 
-def dealloc_reg_tuple(r):
-    if r is None:
-        return
-    if type(r) is str:
-        if is_reg(r):
-            dealloc_reg(r)
-            return
-    reg_list = str(r).replace("'", '').replace(' ', '').replace('(', '').replace(')', '').split(',')
-    for reg in reg_list:
-        if is_reg(reg):
-            dealloc_reg(reg)
+class Loop:
+    """Labels of a loop: where its continues jump to and where its breaks jump to."""
 
+    __slots__ = ('start', 'exit', 'continued')
 
-def is_reg(r):
-    return r in all_registers
+    def __init__(self):
+        self.start = None
+        self.exit = None
+        self.continued = False
 
 
-lbl_cnt = 0
+class Fixup:
+    """An instruction whose last operand is only known once its function is complete.
 
+    `operand` is 'frame' for the size of the function's stack frame, or
+    'start' or 'exit' for that label of `loop`.
+    """
 
-def gen_lbl():
-    global lbl_cnt
-    lbl_cnt += 1
-    return f"lbl{lbl_cnt}"
+    __slots__ = ('text', 'operand', 'loop')
 
+    def __init__(self, text, operand, loop=None):
+        self.text = text
+        self.operand = operand
+        self.loop = loop
 
-def gen_condop(op, p1, p2):
-    lbl_exit = gen_lbl()
-    instructions = []
-    if is_reg(p1):
-        r2 = p1
-    else:
-        r2 = alloc_reg()
-        instructions.append('li $' + r2 + ',' + str(p1))
-
-    if is_reg(p2):
-        r3 = p2
-    else:
-        r3 = alloc_reg()
-        instructions.append('li $' + r3 + ',' + str(p2))
-
-    if op == '==':
-        instructions.append('bne $' + r2 + ', $' + r3 + ', ' + lbl_exit)
-    elif op == '!=':
-        instructions.append('beq $' + r2 + ', $' + r3 + ', ' + lbl_exit)
-    elif op == '<':
-        instructions.append('bge $' + r2 + ', $' + r3 + ', ' + lbl_exit)
-    elif op == '>':
-        instructions.append('ble $' + r2 + ', $' + r3 + ', ' + lbl_exit)
-    elif op == '<=':
-        instructions.append('bgt $' + r2 + ', $' + r3 + ', ' + lbl_exit)
-    elif op == '>=':
-        instructions.append('blt $' + r2 + ', $' + r3 + ', ' + lbl_exit)
-
-    dealloc_reg(r2)
-    dealloc_reg(r3)
-    return lbl_exit, instructions
-
-
-def gen_binop(op, p1, p2):
-    instructions = []
-    if op != '*' and op != '/':
-
-        if is_reg(p1) and not is_reg(p2):
-            if op == '+':
-                instructions.append('addi $' + p1 + ', $' + p1 + ', ' + str(p2))
-            elif op == '-':
-                instructions.append('subi $' + p1 + ', $' + p1 + ', ' + str(p2))
-            elif op == '&':
-                instructions.append('andi $' + p1 + ', $' + p1 + ', ' + str(p2))
-            elif op == '|':
-                instructions.append('ori $' + p1 + ', $' + p1 + ', ' + str(p2))
-            elif op == '^':
-                instructions.append('xori $' + p1 + ', $' + p1 + ', ' + str(p2))
-            return p1, instructions
-
-        if not is_reg(p1) and is_reg(p2):
-            if op == '+':
-                instructions.append('addi $' + p2 + ', $' + p2 + ', ' + str(p1))
-            elif op == '-':
-                instructions.append('subi $' + p2 + ', $' + p2 + ', -' + str(p1))
-            elif op == '&':
-                instructions.append('andi $' + p2 + ', $' + p2 + ', ' + str(p1))
-            elif op == '|':
-                instructions.append('ori $' + p2 + ', $' + p2 + ', ' + str(p1))
-            elif op == '^':
-                instructions.append('xori $' + p2 + ', $' + p2 + ', ' + str(p1))
-            return p2, instructions
-
-    r1 = alloc_reg()
-    if is_reg(p1):
-        r2 = p1
-    else:
-        r2 = alloc_reg()
-        instructions.append('li $' + r2 + ',' + str(p1))
-
-    if is_reg(p2):
-        r3 = p2
-    else:
-        r3 = alloc_reg()
-        instructions.append('li $' + r3 + ',' + str(p2))
-
-    if op == '+':
-        instructions.append('add $' + r1 + ', $' + r2 + ', $' + r3)
-    elif op == '-':
-        instructions.append('sub $' + r1 + ', $' + r2 + ', $' + r3)
-    elif op == '*':
-        instructions.append('mul $' + r1 + ', $' + r2 + ', $' + r3)
-    elif op == '/':
-        instructions.append('div $' + r1 + ', $' + r2 + ', $' + r3)
-    elif op == '&':
-        instructions.append('and $' + r1 + ', $' + r2 + ', $' + r3)
-    elif op == '|':
-        instructions.append('or $' + r1 + ', $' + r2 + ', $' + r3)
-    elif op == '^':
-        instructions.append('xor $' + r1 + ', $' + r2 + ', $' + r3)
-
-    dealloc_reg(r2)
-    dealloc_reg(r3)
-
-    return r1, instructions
-
-
-functions = {}
-g_variables = {}
-l_variables = {}
-s_variables = {}
-
-global_var = True
-global_fun_name = ''
-
-
-def get_stack_num(f_name, v_name):
-    stack = 0
-    for var in l_variables[f_name]:
-        if v_name == var:
-            break
-        stack += l_variables[f_name][var][1]
-    return (stack + 1) * 4
-
-
-def parse_ast(ast):
-    global global_var
-    global global_fun_name
-
-    if type(ast) == int:
-        return ast, []
+    def resolve(self, frame):
+        if self.loop is None:
+            return self.text + str(frame)
+        return self.text + getattr(self.loop, self.operand)
 
-    elif type(ast) == str:
-        if ast == 'continue':
-            return None, ['j START']
 
-        if ast == 'break':
-            return None, ['j END']
+def flatten(code, frame=None):
+    """Return the instructions of a chunk list (strs, Fixups and nested chunk lists) in order.
 
-        if ast == 'ret':
-            instructions = ['lw $ra, 0($sp)',
-                            'addi $sp, $sp, STACK']
-            if global_fun_name != 'main':
-                instructions.append('jr $ra')
-            return None, instructions
+    Fixups are resolved on the way, with `frame` as the stack frame size.
+    """
+    instructions = []
+    chunks = [iter(code)]
+    while chunks:
+        for item in chunks[-1]:
+            if type(item) is str:
+                instructions.append(item)
+            elif type(item) is Fixup:
+                instructions.append(item.resolve(frame))
+            else:
+                chunks.append(iter(item))
+                break
+        else:
+            chunks.pop()
+    return instructions
+
+
+class FunctionCache(MemoryCache):
+    """Generated function bodies keyed by CodeGen.fun_key().
+
+    Keep one around between compiles and CodeGen reuses the code of every
+    function whose subtree and surroundings did not change.
+    """
+
+
+class CodeGen:
+    """Code generation state for one compile.
+
+    Register use, symbol tables, generated functions and the label counter
+    all live here, so every compile starts clean and several can run side
+    by side in one process.
+    """
+
+    def __init__(self, fun_cache=None):
+        self.registers = dict.fromkeys(registers, 0)
+        self.functions = {}
+        self.g_variables = {}
+        self.l_variables = {}
+        self.s_variables = {}
+        self.lbl_cnt = 0
+        self.fun_lbl_cnt = 0
+        self.peak_reg_cnt = 0
+        self.global_var = True
+        self.global_fun_name = ''
+        self.fun_cache = fun_cache
+        self.fun_reused = 0
+        self.loops = []
+
+    def alloc_reg(self):
+        for reg in self.registers:
+            if self.registers[reg] == 0:
+                self.registers[reg] = 1
+                self.peak_reg_cnt = max(self.peak_reg_cnt, sum(self.registers.values()))
+                return reg
+        raise Exception('Not enough register')
+
+    def dealloc_reg(self, r):
+        if r not in self.registers:
+            if r not in all_registers:
+                raise Exception(r + ' is not register!')
+        else:
+            self.registers[r] = 0
 
-    if type(ast[0]) == int:
-        r, instructions = parse_ast(ast[1])
-        return (ast[0], r), instructions
+    def dealloc_reg_tuple(self, r):
+        if r is None:
+            return
+        if type(r) is str:
+            if is_reg(r):
+                self.dealloc_reg(r)
+                return
+        reg_list = str(r).replace("'", '').replace(' ', '').replace('(', '').replace(')', '').split(',')
+        for reg in reg_list:
+            if is_reg(reg):
+                self.dealloc_reg(reg)
+
+    def gen_lbl(self):
+        # labels are numbered per function so that a function's code does not
+        # depend on what was generated before it
+        self.lbl_cnt += 1
+        self.fun_lbl_cnt += 1
+        return f"{self.global_fun_name}_lbl{self.fun_lbl_cnt}"
+
+    def gen_condop(self, op, p1, p2):
+        lbl_exit = self.gen_lbl()
+        instructions = []
+        if is_reg(p1):
+            r2 = p1
+        else:
+            r2 = self.alloc_reg()
+            instructions.append('li $' + r2 + ',' + str(p1))
 
-    elif type(ast[0]) == tuple:
-        r = None
+        if is_reg(p2):
+            r3 = p2
+        else:
+            r3 = self.alloc_reg()
+            instructions.append('li $' + r3 + ',' + str(p2))
+
+        if op == '==':
+            instructions.append('bne $' + r2 + ', $' + r3 + ', ' + lbl_exit)
+        elif op == '!=':
+            instructions.append('beq $' + r2 + ', $' + r3 + ', ' + lbl_exit)
+        elif op == '<':
+            instructions.append('bge $' + r2 + ', $' + r3 + ', ' + lbl_exit)
+        elif op == '>':
+            instructions.append('ble $' + r2 + ', $' + r3 + ', ' + lbl_exit)
+        elif op == '<=':
+            instructions.append('bgt $' + r2 + ', $' + r3 + ', ' + lbl_exit)
+        elif op == '>=':
+            instructions.append('blt $' + r2 + ', $' + r3 + ', ' + lbl_exit)
+
+        self.dealloc_reg(r2)
+        self.dealloc_reg(r3)
+        return lbl_exit, instructions
+
+    def gen_binop(self, op, p1, p2):
         instructions = []
-        for inst in ast:
-            ri, insi = parse_ast(inst)
-            if ri is not None:
-                if r is None:
-                    r = ri
-                else:
-                    r = (r, ri)
-            instructions = instructions + insi
-        return r, instructions
-
-    if ast[0] == 'unit':
-        global_var = True
-        v_e1 = ast[1]
-        v_e2 = ast[2]
-        ins1 = []
-        ins2 = []
-        if type(v_e1) == tuple:
-            v_e1, ins1 = parse_ast(v_e1)
-            dealloc_reg_tuple(v_e1)
-        if type(v_e2) == tuple:
-            v_e2, ins2 = parse_ast(v_e2)
-            dealloc_reg_tuple(v_e2)
-        return None, ins1 + ins2
-
-    if ast[0] == 'fun':
-        global_var = False
-        f_name = ast[2].strip()
-        global_fun_name = f_name
-        has_arg = False
-        if len(ast) > 4:
-            has_arg = True
-            f_arg = ast[3]
-            f_stm = ast[4]
+        if op != '*' and op != '/':
+
+            if is_reg(p1) and not is_reg(p2):
+                if op == '+':
+                    instructions.append('addi $' + p1 + ', $' + p1 + ', ' + str(p2))
+                elif op == '-':
+                    instructions.append('subi $' + p1 + ', $' + p1 + ', ' + str(p2))
+                elif op == '&':
+                    instructions.append('andi $' + p1 + ', $' + p1 + ', ' + str(p2))
+                elif op == '|':
+                    instructions.append('ori $' + p1 + ', $' + p1 + ', ' + str(p2))
+                elif op == '^':
+                    instructions.append('xori $' + p1 + ', $' + p1 + ', ' + str(p2))
+                return p1, instructions
+
+            if not is_reg(p1) and is_reg(p2):
+                if op == '+':
+                    instructions.append('addi $' + p2 + ', $' + p2 + ', ' + str(p1))
+                elif op == '-':
+                    instructions.append('subi $' + p2 + ', $' + p2 + ', -' + str(p1))
+                elif op == '&':
+                    instructions.append('andi $' + p2 + ', $' + p2 + ', ' + str(p1))
+                elif op == '|':
+                    instructions.append('ori $' + p2 + ', $' + p2 + ', ' + str(p1))
+                elif op == '^':
+                    instructions.append('xori $' + p2 + ', $' + p2 + ', ' + str(p1))
+                return p2, instructions
+
+        r1 = self.alloc_reg()
+        if is_reg(p1):
+            r2 = p1
+        else:
+            r2 = self.alloc_reg()
+            instructions.append('li $' + r2 + ',' + str(p1))
+
+        if is_reg(p2):
+            r3 = p2
         else:
-            f_stm = ast[3]
+            r3 = self.alloc_reg()
+            instructions.append('li $' + r3 + ',' + str(p2))
+
+        if op == '+':
+            instructions.append('add $' + r1 + ', $' + r2 + ', $' + r3)
+        elif op == '-':
+            instructions.append('sub $' + r1 + ', $' + r2 + ', $' + r3)
+        elif op == '*':
+            instructions.append('mul $' + r1 + ', $' + r2 + ', $' + r3)
+        elif op == '/':
+            instructions.append('div $' + r1 + ', $' + r2 + ', $' + r3)
+        elif op == '&':
+            instructions.append('and $' + r1 + ', $' + r2 + ', $' + r3)
+        elif op == '|':
+            instructions.append('or $' + r1 + ', $' + r2 + ', $' + r3)
+        elif op == '^':
+            instructions.append('xor $' + r1 + ', $' + r2 + ', $' + r3)
+
+        self.dealloc_reg(r2)
+        self.dealloc_reg(r3)
+
+        return r1, instructions
+
+    def get_stack_num(self, f_name, v_name):
+        stack = 0
+        for var in self.l_variables[f_name]:
+            if v_name == var:
+                break
+            stack += self.l_variables[f_name][var][1]
+        return (stack + 1) * 4
+
+    def gen_fun(self, ast):
+        self.global_var = False
+        f_name = ast.name.strip()
+        self.global_fun_name = f_name
+        self.fun_lbl_cnt = 0
+        has_arg = ast.params is not None
+        f_arg = ast.params
+        f_stm = ast.body
 
         instructions = [f'{f_name}:']
         insa = []
         arg_cnt = 0
         if has_arg:
-            r, insa = parse_ast(f_arg)
-            dealloc_reg_tuple(r)
-            if f_name in l_variables:
-                for var in l_variables[f_name]:
-                    arg_cnt += l_variables[f_name][var][1]
+            r, insa = self.parse_ast(f_arg)
+            insa = flatten(insa)
+            self.dealloc_reg_tuple(r)
+            if f_name in self.l_variables:
+                for var in self.l_variables[f_name]:
+                    arg_cnt += self.l_variables[f_name][var][1]
             if arg_cnt > 4:
                 print('To many argumnets in function: ' + f_name)
-        r, insf = parse_ast(f_stm)
-        dealloc_reg_tuple(r)
+        r, insf = self.parse_ast(f_stm)
+        self.dealloc_reg_tuple(r)
 
         # compute total stack area needed
         tot_var = 1
-        if f_name in l_variables:
-            for var in l_variables[f_name]:
-                tot_var += l_variables[f_name][var][1]
+        if f_name in self.l_variables:
+            for var in self.l_variables[f_name]:
+                tot_var += self.l_variables[f_name][var][1]
 
-        for index, item in enumerate(insf):
-            insf[index] = item.replace('STACK', str(tot_var * 4))
+        insf = flatten(insf, tot_var * 4)
         # allocate stack
         instructions.append('addi $sp, $sp, -' + str(tot_var * 4))
         # save ra
@@ -279,23 +301,138 @@ def parse_ast(ast):
         else:
             insf.append('li $v0 10 #prgoram finished call terminate')
             insf.append('syscall')
-        functions[f_name] = r, instructions + insa + insf
+        self.functions[f_name] = r, instructions + insa + insf
+
+    def fun_key(self, ast):
+        # a function's code depends on its subtree, on which of the names it
+        # uses are globals, and on the registers still held when it starts
+        h = hashlib.sha256()
+        names = set()
+        for node in nodes.walk(ast):
+            if isinstance(node, nodes.Node):
+                h.update(type(node).__name__.encode() + b'(')
+            elif type(node) == list:
+                h.update(b'[%d' % len(node))
+            else:
+                if type(node) == str:
+                    names.add(node)
+                h.update(repr(node).encode() + b',')
+        used_globals = sorted(name for name in names if name in self.g_variables)
+        busy = [reg for reg in self.registers if self.registers[reg]]
+        f_locals = self.l_variables.get(ast.name.strip())
+        h.update(repr((used_globals, busy, f_locals)).encode())
+        return h.hexdigest()
+
+    def gen_fun_cached(self, ast):
+        f_name = ast.name.strip()
+        key = self.fun_key(ast)
+        entry = self.fun_cache.get(key)
+        if entry is not None:
+            self.global_var = False
+            self.global_fun_name = f_name
+            r, instructions = entry['function']
+            self.functions[f_name] = r, list(instructions)
+            self.s_variables.update(entry['strings'])
+            if entry['locals'] is not None:
+                self.l_variables[f_name] = dict(entry['locals'])
+            self.registers.update(entry['registers'])
+            self.lbl_cnt += entry['labels']
+            self.fun_lbl_cnt = entry['fun_labels']
+            self.peak_reg_cnt = max(self.peak_reg_cnt, entry['peak_registers'])
+            self.fun_reused += 1
+            return
+
+        lbl_cnt = self.lbl_cnt
+        strings = len(self.s_variables)
+        peak_reg_cnt = self.peak_reg_cnt
+        self.peak_reg_cnt = sum(self.registers.values())
+        self.gen_fun(ast)
+        locals_ = self.l_variables.get(f_name)
+        self.fun_cache.put(key, {
+            'function': self.functions[f_name],
+            'strings': list(self.s_variables.items())[strings:],
+            'locals': dict(locals_) if locals_ is not None else None,
+            'registers': dict(self.registers),
+            'labels': self.lbl_cnt - lbl_cnt,
+            'fun_labels': self.fun_lbl_cnt,
+            'peak_registers': self.peak_reg_cnt,
+        })
+        self.peak_reg_cnt = max(peak_reg_cnt, self.peak_reg_cnt)
+
+    def parse_ast(self, ast):
+        """Generate code for `ast` and return its (result, instructions).
+
+        Every gen_* method that needs code for a subtree yields the subtree
+        and is sent back that subtree's (result, instructions).  This loop
+        runs them on a stack of suspended generators, so the depth of the
+        tree costs heap instead of interpreter stack.
+
+        The instructions are a chunk list: a gen_* method puts its children's
+        lists into its own instead of copying them.  flatten() joins them
+        once the function they belong to is complete.
+        """
+        generators = self.generators
+        generator_type = types.GeneratorType
+        stack = []
+        while True:
+            generator = generators.get(type(ast))
+            if generator is None:
+                raise Exception('Unknown AST:', ast)
+            step = generator(self, ast)
+            if type(step) is generator_type:
+                stack.append(step)
+                value = None
+            else:
+                value = step
+            while stack:
+                try:
+                    ast = stack[-1].send(value)
+                    break
+                except StopIteration as done:
+                    stack.pop()
+                    value = done.value
+            else:
+                return value
+
+    def gen_number(self, ast):
+        return ast, []
+
+    def gen_sequence(self, ast):
+        # results of the items are gathered into one flat tuple
+        results = []
+        instructions = []
+        for inst in ast:
+            ri, insi = yield inst
+            if ri is not None:
+                results.append(ri)
+            instructions.extend(insi)
+        if not results:
+            return None, instructions
+        if len(results) == 1:
+            return results[0], instructions
+        return tuple(results), instructions
+
+    def gen_fun_def(self, ast):
+        if self.fun_cache is None:
+            self.gen_fun(ast)
+        else:
+            self.gen_fun_cached(ast)
         return None, []
 
-    if ast[0] == 'call':
-        f_name = ast[1]
+    def gen_call(self, ast):
+        f_name = ast.name
         instructions = []
 
-        if len(ast) > 2:
-            f_arg = ast[2]
-            r, instructions = parse_ast(f_arg)
+        if ast.args is not None:
+            f_arg = ast.args
+            r, instructions = yield f_arg
 
             arg_list = str(r).replace("'", '').replace(' ', '').replace('(', '').replace(')', '').split(',')
             arg_cnt = 0
             for a in arg_list:
                 if is_reg(a):
                     instructions.append('add $a' + str(arg_cnt) + ' $zero, $' + a)
-                    dealloc_reg(a)
+                    self.dealloc_reg(a)
                 else:
                     instructions.append('li $a' + str(arg_cnt) + ' ' + a)
                 arg_cnt += 1
@@ -303,277 +440,293 @@ def parse_ast(ast):
         instructions.append('jal ' + f_name)
         return 'v0', instructions
 
-    if ast[0] == 'cond':
-        v_op = ast[1]
-        v_e1 = ast[2]
-        v_e2 = ast[3]
+    def gen_cond(self, ast):
+        v_op = ast.op
+        v_e1 = ast.left
+        v_e2 = ast.right
         ins1 = []
         ins2 = []
-        if type(v_e1) == tuple:
-            v_e1, ins1 = parse_ast(v_e1)
-        if type(v_e2) == tuple:
-            v_e2, ins2 = parse_ast(v_e2)
+        if is_tree(v_e1):
+            v_e1, ins1 = yield v_e1
+        if is_tree(v_e2):
+            v_e2, ins2 = yield v_e2
 
-        lbl, instructions = gen_condop(v_op, v_e1, v_e2)
-        return lbl, ins1 + ins2 + instructions
+        lbl, instructions = self.gen_condop(v_op, v_e1, v_e2)
+        return lbl, [ins1, ins2, instructions]
 
-    if ast[0] == 'if':
-        if_exp = ast[1]
-        if_stmt = ast[2]
+    def gen_if(self, ast):
+        if_exp = ast.cond
+        if_stmt = ast.body
 
         ins_e = []
-        if type(if_exp) == tuple:
-            lbl, ins_e = parse_ast(if_exp)
-        r, ins_s = parse_ast(if_stmt)
-        dealloc_reg_tuple(r)
+        if is_tree(if_exp):
+            lbl, ins_e = yield if_exp
+        r, ins_s = yield if_stmt
+        self.dealloc_reg_tuple(r)
 
-        instructions = ins_e + ins_s
+        instructions = [ins_e, ins_s]
         instructions.append(lbl + ':')
         return None, instructions
 
-    if ast[0] == 'ifelse':
-        if_exp = ast[1]
-        if_stmt = ast[2]
-        else_stmt = ast[3]
+    def gen_ifelse(self, ast):
+        if_exp = ast.cond
+        if_stmt = ast.body
+        else_stmt = ast.orelse
 
         ins_e = []
-        lbl_e = gen_lbl()
-        if type(if_exp) == tuple:
-            lbl, ins_e = parse_ast(if_exp)
+        lbl_e = self.gen_lbl()
+        if is_tree(if_exp):
+            lbl, ins_e = yield if_exp
 
-        r, ins_s = parse_ast(if_stmt)
-        dealloc_reg_tuple(r)
+        r, ins_s = yield if_stmt
+        self.dealloc_reg_tuple(r)
         ins_s.append('j ' + lbl_e)
-        r, ins_else = parse_ast(else_stmt)
-        dealloc_reg_tuple(r)
+        r, ins_else = yield else_stmt
+        self.dealloc_reg_tuple(r)
 
-        instructions = ins_e + ins_s
+        instructions = [ins_e, ins_s]
         instructions.append(lbl + ':')
-        instructions.extend(ins_else)
+        instructions.append(ins_else)
         instructions.append(lbl_e + ':')
         return None, instructions
 
-    if ast[0] == 'while':
-        w_exp = ast[1]
-        w_stmt = ast[2]
+    def gen_while(self, ast):
+        w_exp = ast.cond
+        w_stmt = ast.body
 
         instructions = []
         ins_e = []
         ins_s = []
-        if type(w_exp) == tuple:
-            lbl_exit, ins_e = parse_ast(w_exp)
-        if type(w_stmt) == tuple:
-            r, ins_s = parse_ast(w_stmt)
-            dealloc_reg_tuple(r)
-
-        lbl_start = gen_lbl()
+        loop = Loop()
+        if is_tree(w_exp):
+            lbl_exit, ins_e = yield w_exp
+        if is_tree(w_stmt):
+            self.loops.append(loop)
+            r, ins_s = yield w_stmt
+            self.loops.pop()
+            self.dealloc_reg_tuple(r)
+
+        lbl_start = self.gen_lbl()
+        loop.start = lbl_start
+        loop.exit = lbl_exit
         instructions.append(lbl_start + ':')
-        for index, item in enumerate(ins_s):
-            ins_s[index] = ins_s[index].replace('START', lbl_start)
-            ins_s[index] = ins_s[index].replace('END', lbl_exit)
-        instructions = instructions + ins_e + ins_s
+        instructions += [ins_e, ins_s]
         instructions.append('j ' + lbl_start)
         instructions.append(lbl_exit + ':')
         return None, instructions
 
-    if ast[0] == 'dowhile':
-        w_exp = ast[1]
-        w_stmt = ast[2]
+    def gen_dowhile(self, ast):
+        w_exp = ast.cond
+        w_stmt = ast.body
 
         instructions = []
         ins_e = []
         ins_s = []
-        if type(w_exp) == tuple:
-            lbl_exit, ins_e = parse_ast(w_exp)
-        if type(w_stmt) == tuple:
-            r, ins_s = parse_ast(w_stmt)
-            dealloc_reg_tuple(r)
-            dealloc_reg_tuple(r)
-
-        lbl_start = gen_lbl()
+        loop = Loop()
+        if is_tree(w_exp):
+            lbl_exit, ins_e = yield w_exp
+        if is_tree(w_stmt):
+            self.loops.append(loop)
+            r, ins_s = yield w_stmt
+            self.loops.pop()
+            self.dealloc_reg_tuple(r)
+            self.dealloc_reg_tuple(r)
+
+        lbl_start = self.gen_lbl()
+        loop.start = lbl_start
+        loop.exit = lbl_exit
         instructions.append(lbl_start + ':')
-        for index, item in enumerate(ins_s):
-            ins_s[index] = ins_s[index].replace('START', lbl_start)
-            ins_s[index] = ins_s[index].replace('END', lbl_exit)
-        instructions = instructions + ins_s + ins_e
+        instructions.append(ins_s)
+        if loop.continued:
+            # continue tests the condition again
+            loop.start = self.gen_lbl()
+            instructions.append(loop.start + ':')
+        instructions.append(ins_e)
         instructions.append('j ' + lbl_start)
         instructions.append(lbl_exit + ':')
         return None, instructions
 
-    if ast[0] == 'for':
-        v_exp1 = ast[1]
-        v_exp2 = ast[2]
-        v_exp3 = ast[3]
-        v_stmt = ast[4]
+    def gen_for(self, ast):
+        v_exp1 = ast.init
+        v_exp2 = ast.cond
+        v_exp3 = ast.step
+        v_stmt = ast.body
 
         ins_e1 = []
         ins_e2 = []
         ins_e3 = []
         ins_s = []
-        if type(v_exp1) == tuple:
-            r, ins_e1 = parse_ast(v_exp1)
-            dealloc_reg_tuple(r)
-        if type(v_exp2) == tuple:
-            lbl_exit, ins_e2 = parse_ast(v_exp2)
-        if type(v_exp3) == tuple:
-            r, ins_e3 = parse_ast(v_exp3)
-            dealloc_reg_tuple(r)
-        if type(v_stmt) == tuple:
-            r, ins_s = parse_ast(v_stmt)
-            dealloc_reg_tuple(r)
+        loop = Loop()
+        if is_tree(v_exp1):
+            r, ins_e1 = yield v_exp1
+            self.dealloc_reg_tuple(r)
+        if is_tree(v_exp2):
+            lbl_exit, ins_e2 = yield v_exp2
+        if is_tree(v_exp3):
+            r, ins_e3 = yield v_exp3
+            self.dealloc_reg_tuple(r)
+        if is_tree(v_stmt):
+            self.loops.append(loop)
+            r, ins_s = yield v_stmt
+            self.loops.pop()
+            self.dealloc_reg_tuple(r)
         instructions = ins_e1
-        lbl_start = gen_lbl()
+        lbl_start = self.gen_lbl()
+        loop.start = lbl_start
+        loop.exit = lbl_exit
         instructions.append(lbl_start + ':')
-        for index, item in enumerate(ins_s):
-            ins_s[index] = ins_s[index].replace('START', lbl_start)
-            ins_s[index] = ins_s[index].replace('END', lbl_exit)
-        instructions = instructions + ins_e2 + ins_s + ins_e3
+        instructions += [ins_e2, ins_s]
+        if loop.continued:
+            # continue runs the step before testing the condition again
+            loop.start = self.gen_lbl()
+            instructions.append(loop.start + ':')
+        instructions.append(ins_e3)
         instructions.append('j ' + lbl_start)
         instructions.append(lbl_exit + ':')
 
         return None, instructions
 
-    elif ast[0] == 'decli':
+    def gen_decl(self, ast):
         inse = []
-        v_type = ast[1]
-        v_name = ast[2]
+        v_type = ast.type
+        v_name = ast.name
         stack = 0
-        if global_var:
-            g_variables[v_name] = (v_type, '0')
+        if self.global_var:
+            self.g_variables[v_name] = (v_type, '0')
         else:
-            if global_fun_name not in l_variables:
-                l_variables[global_fun_name] = {v_name: (v_type, 1)}
+            if self.global_fun_name not in self.l_variables:
+                self.l_variables[self.global_fun_name] = {v_name: (v_type, 1)}
             else:
-                l_variables[global_fun_name][v_name] = (v_type, 1)
-            stack = get_stack_num(global_fun_name, v_name)
-        if len(ast) > 3:
-            v_exp = ast[3]
-            if type(v_exp) == tuple:
-                re, inse = parse_ast(v_exp)
+                self.l_variables[self.global_fun_name][v_name] = (v_type, 1)
+            stack = self.get_stack_num(self.global_fun_name, v_name)
+        if ast.init is not None:
+            v_exp = ast.init
+            if is_tree(v_exp):
+                re, inse = yield v_exp
                 v_exp = re
             if is_reg(v_exp):
-                if global_var:
+                if self.global_var:
                     inse.append('sw $' + v_exp + ',' + v_name)
                 else:
                     inse.append('sw $' + v_exp + ', ' + str(stack) + '($sp)')
-                dealloc_reg(re)
+                self.dealloc_reg(re)
             else:
-                r1 = alloc_reg()
-                if global_var:
+                r1 = self.alloc_reg()
+                if self.global_var:
                     inse.append('li $' + r1 + ',' + str(v_exp))
                     inse.append('sw $' + r1 + ',' + v_name)
                 else:
                     inse.append('li $' + r1 + ',' + str(v_exp))
                     inse.append('sw $' + r1 + ', ' + str(stack) + '($sp)')
-                dealloc_reg(r1)
+                self.dealloc_reg(r1)
         else:
-            if not global_var:
+            if not self.global_var:
                 inse.append('sw $zero, ' + str(stack) + '($sp)')
         return None, inse
 
-    elif ast[0] == 'arrdeciz':
-        inse = []
-        v_type = ast[1]
-        v_name = ast[2]
-        v_num = ast[3]
-        stack = 0
-        if global_var:
-            dec = '0'
-            for i in range(int(v_num) - 1):
-                dec += ', 0'
-            g_variables[v_name] = (v_type, dec)
-        else:
-            if global_fun_name not in l_variables:
-                l_variables[global_fun_name] = {v_name: (v_type, v_num)}
+    def gen_array_decl(self, ast):
+        if ast.values is None:
+            inse = []
+            v_type = ast.type
+            v_name = ast.name
+            v_num = ast.size
+            stack = 0
+            if self.global_var:
+                dec = '0'
+                for i in range(int(v_num) - 1):
+                    dec += ', 0'
+                self.g_variables[v_name] = (v_type, dec)
             else:
-                l_variables[global_fun_name][v_name] = (v_type, v_num)
-            stack = get_stack_num(global_fun_name, v_name)
-        if not global_var:
-            for i in range(int(v_num)):
-                inse.append('sw $zero, ' + str(stack + i * 4) + '($sp)')
-        return None, inse
-
-    elif ast[0] == 'arrdeci':
-        inse = []
-        v_type = ast[1]
-        v_name = ast[2]
-        v_num = ast[3]
-        v_list = ast[4]
-        stack = 0
-        if global_var:
-            g_variables[v_name] = (v_type, str(v_list).replace('(', '').replace(')', ''))
+                if self.global_fun_name not in self.l_variables:
+                    self.l_variables[self.global_fun_name] = {v_name: (v_type, v_num)}
+                else:
+                    self.l_variables[self.global_fun_name][v_name] = (v_type, v_num)
+                stack = self.get_stack_num(self.global_fun_name, v_name)
+            if not self.global_var:
+                for i in range(int(v_num)):
+                    inse.append('sw $zero, ' + str(stack + i * 4) + '($sp)')
+            return None, inse
         else:
-            if global_fun_name not in l_variables:
-                l_variables[global_fun_name] = {v_name: (v_type, v_num)}
+            inse = []
+            v_type = ast.type
+            v_name = ast.name
+            v_num = ast.size
+            v_list = ast.values
+            stack = 0
+            if self.global_var:
+                self.g_variables[v_name] = (v_type, ', '.join(str(v) for v in v_list))
             else:
-                l_variables[global_fun_name][v_name] = (v_type, v_num)
-            stack = get_stack_num(global_fun_name, v_name)
-        if not global_var:
-            i = 0
-            r, instructions = parse_ast(v_list)
-            exp_list = str(r).replace("'", '').replace(' ', '').replace('(', '').replace(')', '').split(',')
-            for exp in exp_list:
-                try:
-                    e = int(exp)
-                    r1 = alloc_reg()
-                    instructions.append('li $' + r1 + ',' + str(e))
-                    instructions.append('sw $' + r1 + ', ' + str(stack + i * 4) + '($sp)')
-                    dealloc_reg(r1)
-                except ValueError:
-                    r = exp
-                    instructions.append('sw $' + r + ', ' + str(stack + i * 4) + '($sp)')
-                    dealloc_reg(r)
-                i += 1
-            inse += instructions
-        return None, inse
-
-    elif ast[0] == 'assign':
-        v_name = ast[1]
-        v_exp = ast[2]
+                if self.global_fun_name not in self.l_variables:
+                    self.l_variables[self.global_fun_name] = {v_name: (v_type, v_num)}
+                else:
+                    self.l_variables[self.global_fun_name][v_name] = (v_type, v_num)
+                stack = self.get_stack_num(self.global_fun_name, v_name)
+            if not self.global_var:
+                i = 0
+                r, instructions = yield v_list
+                exp_list = str(r).replace("'", '').replace(' ', '').replace('(', '').replace(')', '').split(',')
+                for exp in exp_list:
+                    try:
+                        e = int(exp)
+                        r1 = self.alloc_reg()
+                        instructions.append('li $' + r1 + ',' + str(e))
+                        instructions.append('sw $' + r1 + ', ' + str(stack + i * 4) + '($sp)')
+                        self.dealloc_reg(r1)
+                    except ValueError:
+                        r = exp
+                        instructions.append('sw $' + r + ', ' + str(stack + i * 4) + '($sp)')
+                        self.dealloc_reg(r)
+                    i += 1
+                inse.append(instructions)
+            return None, inse
+
+    def gen_assign(self, ast):
+        v_name = ast.name
+        v_exp = ast.value
         instructions = []
         stack = 0
-        if v_name not in g_variables:
-            stack = get_stack_num(global_fun_name, v_name)
-        if type(v_exp) == tuple:
-            v_exp, instructions = parse_ast(v_exp)
+        if v_name not in self.g_variables:
+            stack = self.get_stack_num(self.global_fun_name, v_name)
+        if is_tree(v_exp):
+            v_exp, instructions = yield v_exp
             if type(v_exp) == int:
-                r1 = alloc_reg()
+                r1 = self.alloc_reg()
                 instructions.append('li $' + r1 + ',' + str(v_exp))
                 v_exp = r1
-            if v_name in g_variables:
+            if v_name in self.g_variables:
                 instructions.append('sw $' + v_exp + ', ' + v_name)
             else:
                 instructions.append('sw $' + v_exp + ', ' + str(stack) + '($sp)')
-            dealloc_reg(v_exp)
+            self.dealloc_reg(v_exp)
         else:
-            r1 = alloc_reg()
-            if v_name in g_variables:
+            r1 = self.alloc_reg()
+            if v_name in self.g_variables:
                 instructions.append('li $' + r1 + ',' + str(v_exp))
                 instructions.append('sw $' + r1 + ',' + v_name)
             else:
                 instructions.append('li $' + r1 + ',' + str(v_exp))
                 instructions.append('sw $' + r1 + ', ' + str(stack) + '($sp)')
-            dealloc_reg(r1)
+            self.dealloc_reg(r1)
         return None, instructions
 
-    elif ast[0] == 'arrassign':
-        v_name = ast[1]
-        v_ind = ast[2]
-        v_exp = ast[3]
+    def gen_array_assign(self, ast):
+        v_name = ast.name
+        v_ind = ast.index
+        v_exp = ast.value
         instructions = []
         insi = []
         inse = []
         stack = 0
 
-        if v_name not in g_variables:
-            stack = get_stack_num(global_fun_name, v_name)
+        if v_name not in self.g_variables:
+            stack = self.get_stack_num(self.global_fun_name, v_name)
             sp = 'sp'
         else:
-            sp = alloc_reg()
+            sp = self.alloc_reg()
             instructions.append('la $' + sp + ', ' + v_name)
 
-        if type(v_ind) == tuple:
-            v_ind, insi = parse_ast(v_ind)
+        if is_tree(v_ind):
+            v_ind, insi = yield v_ind
 
         # example global array access
         # la $t3, list         # put address of list into $t3
@@ -584,282 +737,387 @@ def parse_ast(ast):
         # lw $t4, 0($t1)       # get the value from the array cell
 
         if not is_reg(v_ind):
-            r_ind = alloc_reg()
+            r_ind = self.alloc_reg()
             insi.append('li $' + r_ind + ',' + str(v_ind))  # add index of array
             v_ind = r_ind
         insi.append('add $' + v_ind + ', $' + v_ind + ', $' + v_ind)  # double the index
         insi.append('add $' + v_ind + ', $' + v_ind + ', $' + v_ind)  # double the index
         insi.append('add $' + v_ind + ', $' + sp + ', $' + v_ind)  # add stack pointer
-        if v_name not in g_variables:
+        if v_name not in self.g_variables:
             insi.append('addi $' + v_ind + ', $' + v_ind + ',' + str(stack))  # add index of array
 
-        if type(v_exp) == tuple:
-            v_exp, inse = parse_ast(v_exp)
+        if is_tree(v_exp):
+            v_exp, inse = yield v_exp
         else:
-            r_exp = alloc_reg()
+            r_exp = self.alloc_reg()
             insi.append('li $' + r_exp + ',' + str(v_exp))  # add index of array
             v_exp = r_exp
         inse.append('sw $' + v_exp + ', ($' + v_ind + ')')
 
-        dealloc_reg(v_ind)
-        dealloc_reg(v_exp)
+        self.dealloc_reg(v_ind)
+        self.dealloc_reg(v_exp)
 
-        instructions += insi + inse
+        instructions += [insi, inse]
 
         if sp is not 'sp':
-            dealloc_reg(sp)
+            self.dealloc_reg(sp)
         return None, instructions
 
-    elif ast[0] == 'arrid':
-        v_name = ast[1]
-        v_ind = ast[2]
+    def gen_array_ref(self, ast):
+        v_name = ast.name
+        v_ind = ast.index
         instructions = []
         stack = 0
-        if v_name not in g_variables:
-            stack = get_stack_num(global_fun_name, v_name)
+        if v_name not in self.g_variables:
+            stack = self.get_stack_num(self.global_fun_name, v_name)
             sp = 'sp'
         else:
-            sp = alloc_reg()
+            sp = self.alloc_reg()
             instructions.append('la $' + sp + ', ' + v_name)
 
-        if type(v_ind) == tuple:
-            v_ind, insi = parse_ast(v_ind)
-            instructions += insi
+        if is_tree(v_ind):
+            v_ind, insi = yield v_ind
+            instructions.append(insi)
 
         if not is_reg(v_ind):
-            r_ind = alloc_reg()
+            r_ind = self.alloc_reg()
             instructions.append('li $' + r_ind + ',' + str(v_ind))  # add index of array
             v_ind = r_ind
         instructions.append('add $' + v_ind + ', $' + v_ind + ', $' + v_ind)  # double the index
         instructions.append('add $' + v_ind + ', $' + v_ind + ', $' + v_ind)  # double the index
         instructions.append('add $' + v_ind + ', $' + sp + ', $' + v_ind)  # add stack pointer
 
-        if v_name not in g_variables:
+        if v_name not in self.g_variables:
             instructions.append('addi $' + v_ind + ', $' + v_ind + ',' + str(stack))  # add index of array
 
         instructions.append('lw $' + v_ind + ', ($' + v_ind + ')')
         if sp is not 'sp':
-            dealloc_reg(sp)
+            self.dealloc_reg(sp)
         return v_ind, instructions
 
-    elif ast[0] == 'ret':
-        v_exp = ast[1]
+    def gen_return(self, ast):
+        if ast.value is None:
+            instructions = ['lw $ra, 0($sp)',
+                            Fixup('addi $sp, $sp, ', 'frame')]
+            if self.global_fun_name != 'main':
+                instructions.append('jr $ra')
+            return None, instructions
+        v_exp = ast.value
         instructions = []
-        if type(v_exp) == tuple:
-            v_exp, instructions = parse_ast(v_exp)
+        if is_tree(v_exp):
+            v_exp, instructions = yield v_exp
         if type(v_exp) == str:
             instructions.append('add $v0, $zero, $' + v_exp)
-            dealloc_reg(v_exp)
+            self.dealloc_reg(v_exp)
         elif type(v_exp) == int:
             instructions.append('li $v0, ' + str(v_exp))
         instructions.append('lw $ra, 0($sp)')
-        instructions.append('addi $sp, $sp, STACK')
-        if global_fun_name != 'main':
+        instructions.append(Fixup('addi $sp, $sp, ', 'frame'))
+        if self.global_fun_name != 'main':
             instructions.append('jr $ra')
         return 'v0', instructions
 
-    elif ast[0] == 'id':
-        v_name = ast[1]
+    def gen_break(self, ast):
+        if not self.loops:
+            raise Exception(f'break outside of a loop at line {ast.lineno}')
+        return None, [Fixup('j ', 'exit', self.loops[-1])]
+
+    def gen_continue(self, ast):
+        if not self.loops:
+            raise Exception(f'continue outside of a loop at line {ast.lineno}')
+        loop = self.loops[-1]
+        loop.continued = True
+        return None, [Fixup('j ', 'start', loop)]
+
+    def gen_id(self, ast):
+        v_name = ast.name
         instructions = []
-        r1 = alloc_reg()
-        if v_name in g_variables:
+        r1 = self.alloc_reg()
+        if v_name in self.g_variables:
             instructions.append('lw $' + r1 + ',' + v_name)
         else:
-            stack = get_stack_num(global_fun_name, v_name)
+            stack = self.get_stack_num(self.global_fun_name, v_name)
             instructions.append('lw $' + r1 + ', ' + str(stack) + '($sp)')
         return r1, instructions
 
-    elif ast[0] == 'char':
-        if "'" not in ast[1]:
-            raise Exception('char type error:' + ast[1])
-        return ord(ast[1].replace("'", '')), []
+    def gen_char(self, ast):
+        if "'" not in ast.value:
+            raise Exception('char type error:' + ast.value)
+        return ord(ast.value.replace("'", '')), []
 
-    elif ast[0] == 'binop':
-        v_op = ast[1]
-        v_e1 = ast[2]
-        v_e2 = ast[3]
+    def gen_arith(self, ast):
+        v_op = ast.op
+        v_e1 = ast.left
+        v_e2 = ast.right
         ins1 = []
         ins2 = []
-        if type(v_e1) == tuple:
-            v_e1, ins1 = parse_ast(v_e1)
-        if type(v_e2) == tuple:
-            v_e2, ins2 = parse_ast(v_e2)
-
-        r, instructions = gen_binop(v_op, v_e1, v_e2)
-        return r, ins1 + ins2 + instructions
+        if is_tree(v_e1):
+            v_e1, ins1 = yield v_e1
+        if is_tree(v_e2):
+            v_e2, ins2 = yield v_e2
 
-    elif ast[0] == 'id':
-        v_name = ast[1]
-        r1 = alloc_reg()
-        instructions = []
-        if v_name in g_variables:
-            instructions.append('lw $' + r1 + ',' + v_name)
-        else:
-            stack = get_stack_num(global_fun_name, v_name)
-            instructions.append('lw $' + r1 + ', ' + str(stack) + '($sp)')
-        return r1, instructions
+        r, instructions = self.gen_binop(v_op, v_e1, v_e2)
+        return r, [ins1, ins2, instructions]
 
-    elif ast[0] == 'asm':
-        return None, [ast[1].replace('"', '')]
+    def gen_asm(self, ast):
+        return None, [ast.code.replace('"', '')]
 
-    elif ast[0] == 'printstr':
-        lbl = gen_lbl()
-        s_variables[lbl] = ast[1]
+    def gen_printstr(self, ast):
+        lbl = self.gen_lbl()
+        self.s_variables[lbl] = ast.text
 
         return None, [f'la $a0, {lbl}',
                       'li $v0, 4',
                       'syscall']
 
-    elif ast[0] == 'uminus':
-        v_exp = ast[1]
+    def gen_uminus(self, ast):
+        v_exp = ast.operand
         instructions = []
-        if type(v_exp) == tuple:
-            v_exp, instructions = parse_ast(v_exp)
+        if is_tree(v_exp):
+            v_exp, instructions = yield v_exp
         if type(v_exp) == int:
             v_exp = -v_exp
         elif is_reg(v_exp):
             instructions.append('sub $' + v_exp + ', $zero, $' + v_exp)
         return v_exp, instructions
 
-    elif ast[0] == 'not':
-        v_exp = ast[1]
+    def gen_not(self, ast):
+        v_exp = ast.operand
         instructions = []
-        if type(v_exp) == tuple:
-            v_exp, instructions = parse_ast(v_exp)
+        if is_tree(v_exp):
+            v_exp, instructions = yield v_exp
         if type(v_exp) == int:
             v_exp = ~v_exp
         elif is_reg(v_exp):
             instructions.append('not $' + v_exp + ', $' + v_exp)
         return v_exp, instructions
 
-    elif ast[0] == 'address':
-        v_name = ast[1]
+    def gen_address(self, ast):
+        v_name = ast.name
         instructions = []
-        r1 = alloc_reg()
-        if v_name in g_variables:
+        r1 = self.alloc_reg()
+        if v_name in self.g_variables:
             instructions.append('la $' + r1 + ',' + v_name)
         else:
-            stack = get_stack_num(global_fun_name, v_name)
+            stack = self.get_stack_num(self.global_fun_name, v_name)
             instructions.append('addi $' + r1 + ', $sp, ' + str(stack))
         return r1, instructions
 
-    elif ast[0] == 'arraddress':
-        v_name = ast[1]
-        v_ind = ast[2]
+    def gen_array_address(self, ast):
+        v_name = ast.name
+        v_ind = ast.index
         instructions = []
         stack = 0
 
-        if v_name not in g_variables:
-            stack = get_stack_num(global_fun_name, v_name)
+        if v_name not in self.g_variables:
+            stack = self.get_stack_num(self.global_fun_name, v_name)
             sp = 'sp'
         else:
-            sp = alloc_reg()
+            sp = self.alloc_reg()
             instructions.append('la $' + sp + ', ' + v_name)
 
-        if type(v_ind) == tuple:
-            v_ind, insi = parse_ast(v_ind)
-            instructions += insi
+        if is_tree(v_ind):
+            v_ind, insi = yield v_ind
+            instructions.append(insi)
 
         if not is_reg(v_ind):
-            r_ind = alloc_reg()
+            r_ind = self.alloc_reg()
             instructions.append('li $' + r_ind + ',' + str(v_ind))  # add index of array
             v_ind = r_ind
         instructions.append('add $' + v_ind + ', $' + v_ind + ', $' + v_ind)  # double the index
         instructions.append('add $' + v_ind + ', $' + v_ind + ', $' + v_ind)  # double the index
         instructions.append('add $' + v_ind + ', $' + sp + ', $' + v_ind)  # add stack pointer
-        if v_name not in g_variables:
+        if v_name not in self.g_variables:
             instructions.append('addi $' + v_ind + ', $' + v_ind + ',' + str(stack))  # add index of array
 
         if sp is not 'sp':
-            dealloc_reg(sp)
+            self.dealloc_reg(sp)
 
         return v_ind, instructions
 
-    elif ast[0] == 'paccess':
-        v_name = ast[1]
+    def gen_deref(self, ast):
+        v_name = ast.name
         instructions = []
-        r1 = alloc_reg()
-        if v_name in g_variables:
+        r1 = self.alloc_reg()
+        if v_name in self.g_variables:
             instructions.append('lw $' + r1 + ',' + v_name)
             instructions.append('lw $' + r1 + ', ($' + r1 + ')')
         else:
-            stack = get_stack_num(global_fun_name, v_name)
+            stack = self.get_stack_num(self.global_fun_name, v_name)
             instructions.append('lw $' + r1 + ', ' + str(stack) + '($sp)')
             instructions.append('lw $' + r1 + ', ($' + r1 + ')')
         return r1, instructions
 
-    elif ast[0] == 'passign':
-        v_name = ast[1]
-        v_exp = ast[2]
+    def gen_ptr_assign(self, ast):
+        v_name = ast.name
+        v_exp = ast.value
         instructions = []
         stack = 0
-        if v_name not in g_variables:
-            stack = get_stack_num(global_fun_name, v_name)
-        if type(v_exp) == tuple:
-            v_exp, instructions = parse_ast(v_exp)
+        if v_name not in self.g_variables:
+            stack = self.get_stack_num(self.global_fun_name, v_name)
+        if is_tree(v_exp):
+            v_exp, instructions = yield v_exp
             if type(v_exp) == int:
-                r1 = alloc_reg()
+                r1 = self.alloc_reg()
                 instructions.append('li $' + r1 + ',' + str(v_exp))
                 v_exp = r1
-            if v_name in g_variables:
-                r2 = alloc_reg()
+            if v_name in self.g_variables:
+                r2 = self.alloc_reg()
                 instructions.append('lw $' + r2 + ',' + v_name)
                 instructions.append('sw $' + v_exp + ', ($' + r2 + ')')
-                dealloc_reg(r2)
+                self.dealloc_reg(r2)
             else:
-                r2 = alloc_reg()
+                r2 = self.alloc_reg()
                 instructions.append('lw $' + r2 + ', ' + str(stack) + '($sp)')
                 instructions.append('sw $' + v_exp + ', ($' + r2 + ')')
-                dealloc_reg(r2)
-            dealloc_reg(v_exp)
+                self.dealloc_reg(r2)
+            self.dealloc_reg(v_exp)
         else:
-            r1 = alloc_reg()
-            if v_name in g_variables:
-                r2 = alloc_reg()
+            r1 = self.alloc_reg()
+            if v_name in self.g_variables:
+                r2 = self.alloc_reg()
                 instructions.append('li $' + r1 + ',' + str(v_exp))
                 instructions.append('lw $' + r2 + ',' + v_name)
                 instructions.append('sw $' + r1 + ', ($' + r2 + ')')
-                dealloc_reg(r2)
+                self.dealloc_reg(r2)
             else:
-                r2 = alloc_reg()
+                r2 = self.alloc_reg()
                 instructions.append('li $' + r1 + ',' + str(v_exp))
                 instructions.append('lw $' + r2 + ', ' + str(stack) + '($sp)')
                 instructions.append('sw $' + r1 + ', ($' + r2 + ')')
-                dealloc_reg(r2)
-            dealloc_reg(r1)
+                self.dealloc_reg(r2)
+            self.dealloc_reg(r1)
         return None, instructions
 
-    raise Exception('Unknown AST:', ast)
-
+    generators = {
+        int: gen_number,
+        list: gen_sequence,
+        nodes.FunDef: gen_fun_def,
+        nodes.Call: gen_call,
+        nodes.Cond: gen_cond,
+        nodes.If: gen_if,
+        nodes.IfElse: gen_ifelse,
+        nodes.While: gen_while,
+        nodes.DoWhile: gen_dowhile,
+        nodes.For: gen_for,
+        nodes.Decl: gen_decl,
+        nodes.ArrayDecl: gen_array_decl,
+        nodes.Assign: gen_assign,
+        nodes.ArrayAssign: gen_array_assign,
+        nodes.ArrayRef: gen_array_ref,
+        nodes.Return: gen_return,
+        nodes.Break: gen_break,
+        nodes.Continue: gen_continue,
+        nodes.Id: gen_id,
+        nodes.Char: gen_char,
+        nodes.BinOp: gen_arith,
+        nodes.Asm: gen_asm,
+        nodes.PrintStr: gen_printstr,
+        nodes.UMinus: gen_uminus,
+        nodes.Not: gen_not,
+        nodes.Address: gen_address,
+        nodes.ArrayAddress: gen_array_address,
+        nodes.Deref: gen_deref,
+        nodes.PtrAssign: gen_ptr_assign,
+    }
+
+    def add_unit(self, unit):
+        # state left by one top-level unit carries over to the next
+        r, instructions = self.parse_ast(unit)
+        self.dealloc_reg_tuple(r)
+        return flatten(instructions)
+
+    def data_section(self):
+        instructions = ['.data']
+
+        for var in self.s_variables:
+            instructions.append(var + ': .asciiz ' + self.s_variables[var])
+
+        for var in self.g_variables:
+            instructions.append(var + ': .word ' + self.g_variables[var][1])
+
+        instructions.append('.text')
+        instructions.append('')
+        return instructions
 
-def parse(ast, asm):
-    _, instructions = parse_ast(ast)
+    def generate(self, units):
+        instructions = []
+        for unit in units:
+            instructions.extend(self.add_unit(unit))
 
-    instructions.append('.data')
+        instructions.extend(self.data_section())
 
-    for var in s_variables:
-        instructions.append(var + ': .asciiz ' + s_variables[var])
+        if 'main' in self.functions:
+            for line in self.functions['main'][1]:
+                instructions.append(line)
+            instructions.append('')
+        else:
+            raise Exception('No main found!')
+
+        for f in self.functions:
+            if f == 'main':
+                continue
+            for line in self.functions[f][1]:
+                instructions.append(line)
+            instructions.append('')
+
+        return instructions
+
+    def generate_stream(self, units, asm, timestamp=True):
+        """Generate code for each top-level unit as it arrives and write the program to `asm`.
+
+        Function bodies go to a temporary file as soon as they are generated,
+        so memory holds one function at a time instead of the whole program.
+        The output is the same as write(generate(ast)).  Returns the number
+        of instructions written.
+        """
+        top = []
+        spilled = {}
+        count = 0
+        with tempfile.TemporaryFile() as spill:
+            for unit in units:
+                top.extend(self.add_unit(unit))
+                for f_name, (_, body) in self.functions.items():
+                    start = spill.tell()
+                    spill.write(''.join(line + '\n' for line in body).encode())
+                    spilled[f_name] = start, spill.tell() - start
+                    count += sum(1 for line in body if is_instruction(line))
+                self.functions.clear()
+
+            if 'main' not in spilled:
+                raise Exception('No main found!')
+
+            # data and top-level code first, then main, then the rest in order
+            write(top + self.data_section(), asm, timestamp)
+            for f_name in ['main'] + [f for f in spilled if f != 'main']:
+                start, size = spilled[f_name]
+                spill.seek(start)
+                asm.write(spill.read(size).decode())
+                asm.write('\n')
+        return count + sum(1 for line in top if is_instruction(line))
+
+    def stats(self, instructions):
+        return {'instructions': sum(1 for line in instructions if is_instruction(line)),
+                'labels': self.lbl_cnt,
+                'peak_registers': self.peak_reg_cnt,
+                'functions_reused': self.fun_reused}
+
+
+def is_instruction(line):
+    return line != '' and not line.endswith(':') and not line.startswith('.') and ': .' not in line
+
+
+def write(instructions, asm, timestamp=True):
+    # without the timestamp the output is byte-for-byte reproducible
+    if timestamp:
+        asm.write('# Generated at: ' + str(datetime.datetime.now()) + '\n')
+    for line in instructions:
+        asm.write(line + '\n')
 
-    for var in g_variables:
-        instructions.append(var + ': .word ' + g_variables[var][1])
 
-    instructions.append('.text')
-    instructions.append('')
+def generate(ast, fun_cache=None):
+    return CodeGen(fun_cache).generate(ast)
 
-    if 'main' in functions:
-        for line in functions['main'][1]:
-            instructions.append(line)
-        instructions.append('')
-    else:
-        raise Exception('No main found!')
-
-    for f in functions:
-        if f == 'main':
-            continue
-        for line in functions[f][1]:
-            instructions.append(line)
-        instructions.append('')
 
-    asm.write('# Generated at: ' + str(datetime.datetime.now()) + '\n')
-    for line in instructions:
-        asm.write(line + '\n')
+def parse(ast, asm):
+    write(generate(ast), asm)
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+import backend
+import frontend
+
+FUNCTION = '''int f{i}(int a) {{
+    int b;
+    b = a * 2 + {i};
+    while (b < 100) {{
+        b = b + 3;
+    }}
+    if (b == 7) {{
+        b = b - 1;
+    }}
+    return b;
+}}
+'''
+
+
+def synthetic_source(lines):
+    # about `lines` lines of small functions, then a main that calls one
+    count = max(1, lines // FUNCTION.count('\n'))
+    parts = [FUNCTION.format(i=i) for i in range(count)]
+    parts.append('int main() {\n    int x;\n    x = f0(1);\n}\n')
+    return ''.join(parts)
+
+
+STATEMENTS = ('        x = x + {i};\n', '        if (x == {i}) {{\n            y = x;\n        }}\n')
+
+
+def long_function(statements):
+    # a single main whose loop body holds `statements` statements
+    body = ''.join(STATEMENTS[i % 2].format(i=i) for i in range(statements))
+    return 'int main() {\n    int x;\n    int y;\n    x = 0;\n    while (x < 10) {\n' + body + '    }\n}\n'
+
+
+def parse_ply(text):
+    # ply's own loop: a LexToken per token and a YaccSymbol per reduction
+    lexer = frontend.get_lexer().clone()
+    tokens = 0
+
+    def counted_token():
+        nonlocal tokens
+        tok = lexer.token()
+        if tok is not None:
+            tokens += 1
+        return tok
+
+    frontend.get_parser().parse(text, lexer=lexer, tokenfunc=counted_token)
+    return tokens
+
+
+def parse_arrays(text):
+    tokens = frontend.tokenize_all(text.encode())
+    frontend.parse_tokens(tokens)
+    return len(tokens)
+
+
+PARSERS = {'ply': parse_ply, 'arrays': parse_arrays}
+
+
+def measure(parse, text):
+    # timed without tracemalloc, which slows allocation down a lot
+    gc.collect()
+    start = time.perf_counter()
+    tokens = parse(text)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    parse(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return tokens, elapsed, peak
+
+
+def codegen_scaling(max_statements):
+    # time per statement stays flat as long as code generation is linear
+    out = sys.stdout
+    out.write(f"{'statements':>10}{'seconds':>10}{'us/stmt':>10}{'instructions':>14}\n")
+    statements = 1000
+    while statements <= max_statements:
+        tree = frontend.parse_tokens(frontend.tokenize_all(long_function(statements).encode()))
+        gc.collect()
+        start = time.perf_counter()
+        instructions = backend.CodeGen().generate(tree)
+        elapsed = time.perf_counter() - start
+        out.write(f'{statements:>10}{elapsed:>10.2f}{elapsed / statements * 1e6:>10.1f}{len(instructions):>14}\n')
+        statements *= 10
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Frontend throughput, or codegen scaling, on synthetic C programs')
+    arg_parser.add_argument('--lines', type=int, default=100000, help='size of the generated program')
+    arg_parser.add_argument('--codegen', action='store_true',
+                            help='time code generation for one function of 1000 up to --statements statements')
+    arg_parser.add_argument('--statements', type=int, default=100000, help='largest function for --codegen')
+    arg_parser.add_argument('parsers', nargs='*', metavar='parser',
+                            help='any of: ' + ', '.join(PARSERS) + ' (default: all)')
+    args = arg_parser.parse_args()
+    for name in args.parsers:
+        if name not in PARSERS:
+            arg_parser.error(f'unknown parser {name!r}')
+
+    if args.codegen:
+        frontend.warm_up()
+        codegen_scaling(args.statements)
+        return
+
+    text = synthetic_source(args.lines)
+    frontend.warm_up()
+    out = sys.stdout
+    out.write(f"{text.count(chr(10))} lines, {len(text)} bytes\n")
+    out.write(f"{'parser':<10}{'tokens':>10}{'seconds':>10}{'tokens/s':>12}{'peak MB':>10}\n")
+    for name in args.parsers or PARSERS:
+        tokens, elapsed, peak = measure(PARSERS[name], text)
+        out.write(f'{name:<10}{tokens:>10}{elapsed:>10.2f}{tokens / elapsed:>12.0f}{peak / 2 ** 20:>10.1f}\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def cache_root():
+    # CC_CACHE_DIR wins, then $XDG_CACHE_HOME, then ~/.cache
+    root = os.environ.get('CC_CACHE_DIR')
+    if not root:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        root = os.path.join(base, 'c-compiler')
+    return root
+
+
+def cache_dir(name):
+    """Return a writable cache directory called `name`, or None if there is none."""
+    path = os.path.join(cache_root(), name)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(path, os.W_OK):
+        return None
+    return path
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary file name next to `path` and move it into place once written.
+
+    Readers never see a half written file, and concurrent writers of the same
+    entry simply replace each other.
+    """
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, f'tmp_{os.getpid()}_{uuid.uuid4().hex}{os.path.splitext(name)[1]}')
+    try:
+        yield tmp
+        if os.path.exists(tmp):
+            os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+class DiskCache:
+    """Content-addressed entries in one cache directory, evicted least recently used first.
+
+    Entries are files named by their key.  A hit refreshes the file's mtime,
+    and once the directory grows past `max_bytes` the stalest entries are
+    removed until it is back under 90% of the cap.  Several processes may
+    share one directory.
+
+    The total size is kept in a 'size' file next to the entries and updated
+    on every put, so a process does not have to stat the whole cache before
+    its first write.  Concurrent writers may lose each other's updates; the
+    directory is only scanned, and the total corrected, when it passes the
+    cap or the file is missing.
+    """
+
+    def __init__(self, name, max_bytes):
+        self.path = cache_dir(name)
+        self.max_bytes = max_bytes
+        self.size = None
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        if self.path is None:
+            return None
+        path = self.entry(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        if self.path is None:
+            return
+        path = self.entry(key)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with atomic_path(path) as tmp:
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+        except OSError:
+            return
+
+        size = self.read_size()
+        if size is None:
+            self.evict()
+            return
+        self.size = size + len(data) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+        else:
+            self.write_size()
+
+    def size_path(self):
+        return os.path.join(self.path, 'size')
+
+    def read_size(self):
+        try:
+            with open(self.size_path()) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def write_size(self):
+        try:
+            with atomic_path(self.size_path()) as tmp:
+                with open(tmp, 'w') as f:
+                    f.write(str(self.size))
+        except OSError:
+            pass
+
+    def entries(self):
+        found = []
+        for sub in os.scandir(self.path):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, e.path))
+        return found
+
+    def evict(self):
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self.size -= size
+        self.write_size()
+
+
+class MemoryCache:
+    """A thread-safe in-process mapping that drops the least recently used entry once full."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+# kept free of compiler imports so that a client start costs only the
+# interpreter; cache.py has none either
+from cache import cache_root
+
+
+def default_socket():
+    # the server listens here too
+    path = os.environ.get('CC_SOCKET')
+    if not path:
+        path = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or cache_root(), 'c-compiler.sock')
+    return path
+
+
+class Client:
+    def __init__(self, path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path or default_socket())
+        self.rfile = self.sock.makefile('rb')
+
+    def compile(self, source, filename=None):
+        request = {'source': source, 'filename': filename}
+        self.sock.sendall(json.dumps(request).encode() + b'\n')
+        return json.loads(self.rfile.readline())
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def compile_to(client, source, output):
+    with open(source, 'r') as f:
+        response = client.compile(f.read(), filename=source)
+    for line in response['diagnostics']:
+        print(line)
+    if response['error'] is not None:
+        return response['error']
+    with open(output, 'w') as f:
+        f.write(response['asm'])
+    return None
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='client for the C to MIPS compile server')
+    arg_parser.add_argument('files', nargs='*', metavar='file',
+                            help='SOURCE OUTPUT, or the sources to compile with --batch')
+    arg_parser.add_argument('--batch', action='store_true',
+                            help='compile every source, writing each .s next to its input')
+    arg_parser.add_argument('--manifest', metavar='FILE',
+                            help='with --batch, read more sources from FILE (one path per line)')
+    arg_parser.add_argument('--socket', metavar='PATH', default=default_socket(),
+                            help='server socket (default: %(default)s)')
+    args = arg_parser.parse_args()
+    if args.manifest and not args.batch:
+        arg_parser.error('--manifest requires --batch')
+    if not args.batch and len(args.files) != 2:
+        arg_parser.error('expected SOURCE OUTPUT')
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client = Client(args.socket)
+
+    if not args.batch:
+        error = compile_to(client, args.files[0], args.files[1])
+        if error is not None:
+            print(error)
+        sys.exit(0)
+
+    sources = list(args.files)
+    if args.manifest:
+        with open(args.manifest) as f:
+            sources += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    failed = 0
+    for source in sources:
+        try:
+            error = compile_to(client, source, os.path.splitext(source)[0] + '.s')
+        except OSError as e:
+            error = str(e)
+        if error is not None:
+            failed += 1
+            print(f'{source}: {error}', file=sys.stderr)
+    print(f'{len(sources) - failed} compiled, {failed} failed', file=sys.stderr)
+    sys.exit(1 if failed else 0)
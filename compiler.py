@@ -0,0 +1,127 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+
+import backend
+import frontend
+import nodes
+import ply
+from cache import DiskCache
+
+# size cap for the compiled-output cache (CC_CACHE_SIZE, in bytes)
+COMPILE_CACHE_BYTES = int(os.environ.get('CC_CACHE_SIZE', 256 * 1024 * 1024))
+
+
+def compile_string(source, filename=None, with_ast=False, timestamp=True, fun_cache=None,
+                   unit_cache=None):
+    """Compile C source (str or bytes) to MIPS assembly without touching the filesystem.
+
+    Returns the assembly text, or an (assembly, ast) pair when `with_ast` is
+    set.  Syntax errors raise frontend.ParseException.  With `timestamp`
+    off the output depends on nothing but the source and `filename`.
+    A frontend.UnitCache and a backend.FunctionCache kept between compiles
+    (`unit_cache`, `fun_cache`) let top-level units unchanged since an
+    earlier compile skip parsing and code generation.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        # the same newlines a text-mode read would give
+        source = source.decode().replace('\r\n', '\n').replace('\r', '\n')
+
+    ast = frontend.parse(source, unit_cache=unit_cache)
+    instructions = backend.generate(ast, fun_cache)
+
+    asm = io.StringIO()
+    if filename is not None:
+        asm.write('# Generated from: ' + filename + '\n')
+    backend.write(instructions, asm, timestamp)
+
+    if with_ast:
+        return asm.getvalue(), ast
+    return asm.getvalue()
+
+
+_compiler_version = None
+
+
+def compiler_version():
+    # anything that can change the output: ply, the grammar, the syntax
+    # tree nodes, the code generator and the output framing in this file
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256(ply.__version__.encode())
+        for path in (frontend.__file__, nodes.__file__, backend.__file__, __file__):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+
+def cache_key(source, **options):
+    if isinstance(source, str):
+        source = source.encode()
+    digest = hashlib.sha256(compiler_version().encode())
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    digest.update(source)
+    return digest.hexdigest()
+
+
+class CompileCache(DiskCache):
+    """Compiled assembly keyed by source hash, compiler version and options."""
+
+    def __init__(self, max_bytes=COMPILE_CACHE_BYTES):
+        super().__init__('compile', max_bytes)
+
+    def compile(self, source, filename=None):
+        # cached output is always built without the timestamp header
+        key = cache_key(source, filename=filename, timestamp=False)
+        asm = self.get(key)
+        if asm is not None:
+            return asm.decode()
+        asm = compile_string(source, filename=filename, timestamp=False)
+        self.put(key, asm.encode())
+        return asm
+
+
+# the compile cache of a pool worker, opened once by init_worker()
+worker_cache = None
+
+
+def init_worker(production, use_cache=False):
+    # process pool initializer: same mode as the parent, tables built up front
+    global worker_cache
+    frontend.production = production
+    frontend.warm_up()
+    if use_cache:
+        worker_cache = CompileCache()
+
+
+def output_path(source_path):
+    return os.path.splitext(source_path)[0] + '.s'
+
+
+def map_source(path):
+    """Return the contents of `path` as a read-only mmap, without reading or decoding it."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def compile_file(source_path, asm_path=None, cache=None, timestamp=True):
+    """Compile `source_path` and write the assembly to `asm_path` (default: next to the source).
+
+    With a CompileCache the output is taken from, or added to, the cache.
+    """
+    if asm_path is None:
+        asm_path = output_path(source_path)
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    if cache is not None:
+        asm = cache.compile(source, filename=source_path)
+    else:
+        asm = compile_string(source, filename=source_path, timestamp=timestamp)
+    with open(asm_path, 'w') as f:
+        f.write(asm)
+    return asm_path
@@ -0,0 +1,80 @@
+import gc
+import os
+import sys
+
+import frontend
+from compiler import compile_file
+
+# longest error message a child sends back; keeps it well inside the pipe buffer
+MAX_ERROR = 4096
+
+
+def run_child(source, output, error_fd):
+    # whatever happens, including Ctrl-C or SystemExit, the child must not
+    # unwind into the parent's serve() loop
+    status = 1
+    try:
+        compile_file(source, output)
+        status = 0
+    except Exception as e:
+        os.write(error_fd, str(e).encode()[:MAX_ERROR])
+    finally:
+        # _exit skips the interpreter's cleanup, so push out what the lexer
+        # and parser printed first
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+
+def serve(requests=None, replies=None, jobs=1):
+    """Compile each `SOURCE [OUTPUT]` line of `requests` in a forked child.
+
+    The parent builds the lexer and parse tables once; children share them
+    copy-on-write and exit after a single compile, so no codegen state can
+    leak from one file to the next.  Each finished compile is answered with
+    `ok SOURCE` or `error SOURCE: MESSAGE` on `replies`.
+    """
+    requests = requests or sys.stdin
+    replies = replies or sys.stdout
+
+    frontend.warm_up()
+    # move the warmed objects out of the collector's reach so that children
+    # do not dirty the shared pages by touching their GC headers
+    gc.freeze()
+
+    running = {}
+
+    def reap():
+        pid, status = os.wait()
+        status = os.waitstatus_to_exitcode(status)
+        source, error_fd = running.pop(pid)
+        with os.fdopen(error_fd, 'rb') as f:
+            error = f.read().decode(errors='replace')
+        if status == 0:
+            replies.write(f'ok {source}\n')
+        else:
+            replies.write(f'error {source}: {error or "compiler exited with status " + str(status)}\n')
+        replies.flush()
+
+    for line in requests:
+        parts = line.split()
+        if not parts:
+            continue
+        source = parts[0]
+        output = parts[1] if len(parts) > 1 else None
+
+        while len(running) >= jobs:
+            reap()
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            run_child(source, output, write_fd)
+        os.close(write_fd)
+        running[pid] = (source, read_fd)
+
+    while running:
+        reap()
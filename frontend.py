@@ -1,6 +1,21 @@
+import hashlib
+import importlib.util
+import itertools
+import os
+import pickle
+import re
+import sys
+import threading
+from array import array
+
 import ply.yacc as yacc
 import ply.lex as lex
 
+from cache import MemoryCache, atomic_path, cache_dir
+from nodes import (Node, FunDef, Decl, ArrayDecl, Call, Asm, PrintStr, Return, Break, Continue, If, IfElse,
+                   While, DoWhile, For, Assign, ArrayAssign, PtrAssign, BinOp, Cond, Not, UMinus, Id, ArrayRef,
+                   Address, ArrayAddress, Deref, Char, shifted, walk)
+
 
 class ParseException(Exception):
     pass
@@ -104,9 +119,6 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-# Build the lexer
-lex.lex()
-
 # Parsing rules
 precedence = (
     ('left', '+', '-'),
@@ -119,9 +131,10 @@ def p_file(p):
     """file : unit
             | file unit"""
     if len(p) >= 3:
-        p[0] = ('unit', p[1], p[2])
-    else:
+        p[1].append(p[2])
         p[0] = p[1]
+    else:
+        p[0] = [p[1]]
 
 
 def p_unit(p):
@@ -134,9 +147,9 @@ def p_statement_fun_def(p):
     """fun_def : declaration_specifier ID "(" ")" compound_statement
                | declaration_specifier ID "(" declaration_list ")" compound_statement"""
     if len(p) >= 7:
-        p[0] = ('fun', p[1], p[2], p[4], p[6])
+        p[0] = FunDef(p[1], p[2], p[4], p[6], p.lineno(2))
     else:
-        p[0] = ('fun', p[1], p[2], p[5])
+        p[0] = FunDef(p[1], p[2], None, p[5], p.lineno(2))
 
 
 def p_statement_expr(p):
@@ -150,19 +163,19 @@ def p_statement_fun_call(p):
     """expression : ID "(" ")"
                   | ID "(" expression_list ")" """
     if len(p) > 4:
-        p[0] = ('call', p[1], p[3])
+        p[0] = Call(p[1], p[3], p.lineno(1))
     else:
-        p[0] = ('call', p[1])
+        p[0] = Call(p[1], None, p.lineno(1))
 
 
 def p_statement_asm_call(p):
     """expression : ASM "(" S_CONST ")" """
-    p[0] = (p[1], p[3])
+    p[0] = Asm(p[3], p.lineno(1))
 
 
 def p_statement_str_call(p):
     """expression : PRINTSTR "(" S_CONST ")" """
-    p[0] = (p[1], p[3])
+    p[0] = PrintStr(p[3], p.lineno(1))
 
 
 def p_declaration_specifier(p):
@@ -181,140 +194,153 @@ def p_statement_return(p):
     """statement : RETURN expression ";"
                  | RETURN ";" """
     if len(p) >= 4:
-        p[0] = ("ret", p[2])
+        p[0] = Return(p[2], p.lineno(1))
     else:
-        p[0] = ("ret",)
+        p[0] = Return(None, p.lineno(1))
 
 
 def p_statement_break(p):
     """statement : BREAK ";" """
-    p[0] = ('break',)
+    p[0] = Break(p.lineno(1))
 
 
 def p_statement_continue(p):
     """statement : CONTINUE ";" """
-    p[0] = ('continue',)
+    p[0] = Continue(p.lineno(1))
 
 
 def p_statement_while_def(p):
     """statement : WHILE "(" expression ")" statement"""
-    p[0] = ('while', p[3], p[5])
+    p[0] = While(p[3], p[5], p.lineno(1))
 
 
 def p_statement_dowhile_def(p):
     """statement : DO statement WHILE "(" expression ")" ";" """
-    p[0] = ('dowhile', p[5], p[2])
+    p[0] = DoWhile(p[5], p[2], p.lineno(1))
 
 
 def p_statement_for_def(p):
     """statement : FOR "(" expression ";" expression ";" expression ")" statement"""
-    p[0] = ('for', p[3], p[5], p[7], p[9])
+    p[0] = For(p[3], p[5], p[7], p[9], p.lineno(1))
 
 
 def p_statement_if_def(p):
     """statement : IF "(" expression ")" statement"""
-    p[0] = ('if', p[3], p[5])
+    p[0] = If(p[3], p[5], p.lineno(1))
 
 
 def p_statement_if_else_def(p):
     """statement : IF "(" expression ")" statement ELSE statement"""
-    p[0] = ('ifelse', p[3], p[5], p[7])
+    p[0] = IfElse(p[3], p[5], p[7], p.lineno(1))
 
 
 def p_statement_arr_def(p):
     """declaration : declaration_specifier ID "[" NUMBER "]" "=" "{" expression_list "}"
                    | declaration_specifier ID "[" NUMBER "]" """
     if len(p) <= 7:
-        p[0] = ('arrdeciz', p[1], p[2], p[4])
+        p[0] = ArrayDecl(p[1], p[2], p[4], None, p.lineno(2))
     else:
-        p[0] = ('arrdeci', p[1], p[2], p[4], p[8])
+        p[0] = ArrayDecl(p[1], p[2], p[4], p[8], p.lineno(2))
 
 
 def p_statement_def(p):
     """declaration : declaration_specifier ID "=" expression
                    | declaration_specifier ID """
     if len(p) >= 5:
-        p[0] = ('decli', p[1], p[2], p[4])
+        p[0] = Decl(p[1], p[2], p[4], p.lineno(2))
     else:
-        p[0] = ('decli', p[1], p[2])
+        p[0] = Decl(p[1], p[2], None, p.lineno(2))
 
 
 def p_statement_rminusminus(p):
     """expression : MINUSMINUS ID"""
-    p[0] = (('assign', p[2], ('binop', '-', ('id', p[2]), '1')), ('id', p[2]))
+    line = p.lineno(1)
+    p[0] = [Assign(p[2], BinOp('-', Id(p[2], line), '1', line), line), Id(p[2], line)]
 
 
 def p_statement_minusminus(p):
     """expression : ID MINUSMINUS"""
-    p[0] = (('id', p[1]), ('assign', p[1], ('binop', '-', ('id', p[1]), '1')))
+    line = p.lineno(1)
+    p[0] = [Id(p[1], line), Assign(p[1], BinOp('-', Id(p[1], line), '1', line), line)]
 
 
 def p_statement_rplusplus(p):
     """expression : PLUSPLUS ID """
-    p[0] = (('assign', p[2], ('binop', '+', ('id', p[2]), '1')), ('id', p[2]))
+    line = p.lineno(1)
+    p[0] = [Assign(p[2], BinOp('+', Id(p[2], line), '1', line), line), Id(p[2], line)]
 
 
 def p_statement_plusplus(p):
     """expression : ID PLUSPLUS """
-    p[0] = (('id', p[1]), ('assign', p[1], ('binop', '+', ('id', p[1]), '1')))
+    line = p.lineno(1)
+    p[0] = [Id(p[1], line), Assign(p[1], BinOp('+', Id(p[1], line), '1', line), line)]
 
 
 def p_statement_xoreq(p):
     """expression : ID XOREQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '^', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('^', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_andeq(p):
     """expression : ID ANDEQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '&', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('&', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_oreq(p):
     """expression : ID OREQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '|', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('|', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_muleq(p):
     """expression : ID TIMESEQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '*', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('*', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_diveq(p):
     """expression : ID DIVEQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '/', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('/', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_pluseq(p):
     """expression : ID PLUSEQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '+', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('+', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_minuseq(p):
     """expression : ID MINUSEQUAL expression"""
-    p[0] = ('assign', p[1], ('binop', '-', ('id', p[1]), p[3]))
+    line = p.lineno(1)
+    p[0] = Assign(p[1], BinOp('-', Id(p[1], line), p[3], line), line)
 
 
 def p_statement_assign(p):
     """expression : ID "=" expression"""
-    p[0] = ('assign', p[1], p[3])
+    p[0] = Assign(p[1], p[3], p.lineno(1))
 
 
 def p_expression_list(p):
     """expression_list : expression
                        | expression_list ',' expression"""
     if len(p) >= 3:
-        p[0] = (p[1], p[3])
-    else:
+        p[1].append(p[3])
         p[0] = p[1]
+    else:
+        p[0] = [p[1]]
 
 
 def p_declaration_list(p):
     """declaration_list : declaration
                         | declaration_list ',' declaration"""
     if len(p) >= 3:
-        p[0] = (p[1], p[3])
-    else:
+        p[1].append(p[3])
         p[0] = p[1]
+    else:
+        p[0] = [p[1]]
 
 
 def p_expression_binop(p):
@@ -325,17 +351,17 @@ def p_expression_binop(p):
                   | expression '&' expression
                   | expression '|' expression
                   | expression '^' expression"""
-    p[0] = ('binop', p[2], p[1], p[3])
+    p[0] = BinOp(p[2], p[1], p[3], p.lineno(1))
 
 
 def p_expression_not(p):
     """expression : '~' expression %prec UMINUS"""
-    p[0] = ('not', p[2])
+    p[0] = Not(p[2], p.lineno(1))
 
 
 def p_expression_uminus(p):
     """expression : '-' expression %prec UMINUS"""
-    p[0] = ('uminus', p[2])
+    p[0] = UMinus(p[2], p.lineno(1))
 
 
 def p_expression_group(p):
@@ -345,12 +371,12 @@ def p_expression_group(p):
 
 def p_expression_arr_name(p):
     """expression : ID '[' expression ']'"""
-    p[0] = ('arrid', p[1], p[3])
+    p[0] = ArrayRef(p[1], p[3], p.lineno(1))
 
 
 def p_expression_arr_assign(p):
     """expression : ID '[' expression ']' '=' expression"""
-    p[0] = ('arrassign', p[1], p[3], p[6])
+    p[0] = ArrayAssign(p[1], p[3], p[6], p.lineno(1))
 
 
 def p_expression_number(p):
@@ -360,27 +386,27 @@ def p_expression_number(p):
 
 def p_expression_name(p):
     """expression : ID"""
-    p[0] = ('id', p[1])
+    p[0] = Id(p[1], p.lineno(1))
 
 
 def p_expression_address(p):
     """expression : '&' ID"""
-    p[0] = ('address', p[2])
+    p[0] = Address(p[2], p.lineno(1))
 
 
 def p_expression_arr_address(p):
     """expression : '&' ID '[' expression ']' """
-    p[0] = ('arraddress', p[2], p[4])
+    p[0] = ArrayAddress(p[2], p[4], p.lineno(1))
 
 
 def p_statement_ptr_assign(p):
     """expression : "*" ID "=" expression"""
-    p[0] = ('passign', p[2], p[4])
+    p[0] = PtrAssign(p[2], p[4], p.lineno(1))
 
 
 def p_expression_pointer_access(p):
     """expression : '*' ID"""
-    p[0] = ('paccess', p[2])
+    p[0] = Deref(p[2], p.lineno(1))
 
 
 def p_expression_pointer(p):
@@ -394,7 +420,7 @@ def p_expression_pointer(p):
 
 def p_expression_char(p):
     """expression : C_CONST"""
-    p[0] = ('char', p[1])
+    p[0] = Char(p[1], p.lineno(1))
 
 
 def p_cond_exp(p):
@@ -411,7 +437,7 @@ def p_eq_exp(p):
               | expression '>' expression
               | expression GE expression
               | expression LE expression"""
-    p[0] = ('cond', p[2], p[1], p[3])
+    p[0] = Cond(p[2], p[1], p[3], p.lineno(1))
 
 
 def p_compound_statement(p):
@@ -419,15 +445,18 @@ def p_compound_statement(p):
                           | "{" "}" """
     if len(p) >= 4:
         p[0] = p[2]
+    else:
+        p[0] = []
 
 
 def p_statement_list(p):
     """statement_list : statement
                       | statement_list statement"""
     if len(p) >= 3:
-        p[0] = (p[1], p[2])
-    else:
+        p[1].append(p[2])
         p[0] = p[1]
+    else:
+        p[0] = [p[1]]
 
 
 def p_error(p):
@@ -437,4 +466,549 @@ def p_error(p):
         raise ParseException("Syntax error at EOF")
 
 
-yacc.yacc()
+# Production mode trusts the cached tables and skips ply's grammar and token
+# rule validation (which re-reads this file and checks every rule docstring).
+# Enable it with CC_PRODUCTION=1 or `main.py --production`.
+production = os.environ.get('CC_PRODUCTION', '') not in ('', '0')
+
+
+def lexer_signature(linfo):
+    parts = [lex.__tabversion__, ' '.join(linfo.tokens), ''.join(linfo.literals), repr(linfo.reflags)]
+    for state in sorted(linfo.stateinfo):
+        parts.append(f'{state}:{linfo.stateinfo[state]}:{linfo.ignore.get(state, "")!r}')
+        for name, f in linfo.funcsym[state]:
+            parts.append(f'{name}={lex._get_regex(f)}')
+        for name, r in linfo.strsym[state]:
+            parts.append(f'{name}={r}')
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+# Reflecting on the token rules and the grammar costs more than reading the
+# cached tables, so in production they are looked up by a hash of this file
+# (and the ply version) instead; any edit here then picks fresh tables.
+def source_key(kind):
+    with open(__file__, 'rb') as f:
+        data = f.read()
+    prefix = f'{kind}:{lex.__tabversion__}:{yacc.__version__}:'.encode()
+    return hashlib.sha256(prefix + data).hexdigest()
+
+
+# The master regular expressions are kept in a lextab module in the cache
+# directory, named after a hash of the token rules so that any change to a
+# t_* rule picks a fresh table.  Production builds skip the reflection and
+# name the table after source_key() instead.  Within a process the built lexer is shared
+# (see get_lexer()), and workers forked after warm_up() inherit its compiled
+# regexes.
+def build_lexer():
+    module = sys.modules[__name__]
+    ldict = globals().copy()
+    if production:
+        tab_name = 'lextab_' + source_key('lex')[:32]
+    else:
+        linfo = lex.LexerReflect(ldict)
+        linfo.get_all()
+        if linfo.validate_all():
+            raise SyntaxError("Can't build lexer")
+        tab_name = 'lextab_' + lexer_signature(linfo)[:32]
+
+    tab_dir = cache_dir('lextab')
+    tab_file = os.path.join(tab_dir, tab_name + '.py') if tab_dir else None
+    if tab_file and os.path.exists(tab_file):
+        try:
+            spec = importlib.util.spec_from_file_location(tab_name, tab_file)
+            lextab = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(lextab)
+            lexer = lex.Lexer()
+            lexer.readtab(lextab, ldict)
+            lexer.lexoptimize = production
+            return lexer
+        except Exception:
+            # unreadable entry: rebuild it below
+            pass
+
+    # the rules are validated above, so let ply skip doing it again; the
+    # empty lextab name stops it from reading or writing one next to the sources
+    lexer = lex.lex(module=module, optimize=True, lextab='')
+    lexer.lexoptimize = production
+    if tab_file:
+        try:
+            with atomic_path(tab_file) as tmp:
+                lexer.writetab(os.path.splitext(os.path.basename(tmp))[0], tab_dir)
+        except OSError:
+            pass
+    return lexer
+
+
+# Parse tables are cached per grammar signature and ply version (per
+# source_key() in production), outside the source tree, so that a warm start
+# skips the LALR construction entirely.
+yacc.pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+
+def build_parser():
+    module = sys.modules[__name__]
+    pdict = globals().copy()
+    if production:
+        pinfo = signature = None
+        key = source_key('yacc')
+    else:
+        pinfo = yacc.ParserReflect(pdict)
+        pinfo.get_all()
+        signature = pinfo.signature()
+        key = hashlib.sha256(f'{yacc.__version__}:{signature}'.encode()).hexdigest()
+
+    tab_dir = cache_dir('parsetab')
+    if tab_dir is None:
+        return yacc.yacc(module=module, debug=False, write_tables=False)
+
+    tab_file = os.path.join(tab_dir, key + '.pickle')
+    if os.path.exists(tab_file):
+        lr = yacc.LRTable()
+        try:
+            if pinfo is None:
+                lr.read_pickle(tab_file)
+                lr.bind_callables(pdict)
+                return yacc.LRParser(lr, pdict.get('p_error'))
+            if lr.read_pickle(tab_file) == signature:
+                if pinfo.validate_all():
+                    raise yacc.YaccError('Unable to build parser')
+                lr.bind_callables(pdict)
+                return yacc.LRParser(lr, pinfo.error_func)
+        except yacc.YaccError:
+            raise
+        except Exception:
+            # unreadable entry (truncated, foreign pickle, ...): rebuild it
+            pass
+
+    with atomic_path(tab_file) as tmp:
+        return yacc.yacc(module=module, debug=False, write_tables=False, picklefile=tmp)
+
+
+# The lexer and parser are built on first use and shared afterwards.  Batch
+# jobs call warm_up() once before forking so that workers inherit them.
+_lexer = None
+_parser = None
+_build_lock = threading.Lock()
+
+
+def get_lexer():
+    global _lexer
+    if _lexer is None:
+        with _build_lock:
+            if _lexer is None:
+                _lexer = build_lexer()
+    return _lexer
+
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        with _build_lock:
+            if _parser is None:
+                _parser = build_parser()
+    return _parser
+
+
+def warm_up():
+    get_lexer()
+    get_parser()
+
+
+class UnitCache(MemoryCache):
+    """Parsed top-level units keyed by a hash of their text, with the line they started on.
+
+    Pass one to parse() on every compile of a file and only the functions
+    and global declarations that changed are parsed again.
+    """
+
+
+class BytesLexer:
+    """The lexer's rules run over a bytes-like buffer, such as an mmap of the source.
+
+    Nothing is decoded up front: tokenize_all() records where each token
+    is, and its text is decoded only when asked for.  Positions are byte
+    offsets.  The buffer has not been through a text-mode read, so the CR
+    of a CRLF line ending is skipped like any other blank.
+
+    The bytes rules only know ASCII.  A buffer holding anything else is
+    decoded and lexed as text instead (see tokenize_all()), where names and
+    numbers match what they match under ply and skip() skips characters.
+    """
+
+    def __init__(self, data, lineno=1):
+        self.ignore = bytes_ignore() if not isinstance(data, str) else bytes_ignore().decode()
+        self.errorf = get_lexer().lexerrorf
+        self.lexdata = data
+        self.lexpos = 0
+        self.lexlen = len(data)
+        self.lineno = lineno
+
+    def skip(self, n):
+        self.lexpos += n
+
+    def tokenize_all(self):
+        """Lex the rest of the buffer in one go into a TokenArrays."""
+        data = self.lexdata
+        binary = not isinstance(data, str)
+        decode = bytes.decode if binary else str
+        pos = self.lexpos
+        names = token_names()
+        type_ids = {name: i for i, name in enumerate(names)}
+        # literals are looked up by buffer item: an int in bytes, a str in text
+        type_ids.update({ord(name): i for i, name in enumerate(names) if len(name) == 1})
+        tokens = TokenArrays(data, self.lineno, names)
+        values = tokens.values
+        types_append = tokens.types.append
+        offsets_append = tokens.offsets.append
+        ends_append = tokens.ends.append
+        lines_append = tokens.lines.append
+        scanners = get_bulk_scanners(bytes if binary else str)
+        literal = scanners[-1][0].groups
+        # rule functions are handed this one token over and over
+        scratch = lex.LexToken()
+        scratch.lexer = self
+        while pos < self.lexlen:
+            for scanner, lexindexfunc in scanners:
+                m = scanner.match(data, pos)
+                if m:
+                    break
+            else:
+                while pos < self.lexlen and data[pos] in self.ignore:
+                    pos += 1
+                if pos == self.lexlen:
+                    break
+                scratch.type = 'error'
+                scratch.value = bytes(data[pos:pos + 16]).decode(errors='replace') if binary else data[pos:pos + 16]
+                scratch.lineno = self.lineno
+                scratch.lexpos = pos
+                self.lexpos = pos
+                if not self.errorf:
+                    raise lex.LexError(f'Illegal character at byte {pos}', data[pos:pos + 16])
+                self.errorf(scratch)
+                if self.lexpos == pos:
+                    raise lex.LexError(f'Illegal character at byte {pos}', data[pos:pos + 16])
+                pos = self.lexpos
+                continue
+
+            index = m.lastindex
+            start = m.start(index)
+            pos = m.end()
+            if index == literal and lexindexfunc is scanners[-1][1]:
+                types_append(type_ids[data[start]])
+                offsets_append(start)
+                ends_append(pos)
+                lines_append(self.lineno)
+                continue
+
+            func, toktype = lexindexfunc[index]
+            if func:
+                scratch.value = text = decode(m.group(index))
+                scratch.type = toktype
+                scratch.lineno = self.lineno
+                scratch.lexpos = start
+                self.lexmatch = m
+                self.lexpos = pos
+                tok = func(scratch)
+                pos = self.lexpos
+                if not tok:
+                    continue
+                toktype = tok.type
+                # only values a rule computed are kept, the rest are the token's text
+                if tok.value is not text:
+                    values[len(tokens.types)] = tok.value
+            elif not toktype:
+                continue
+            types_append(type_ids[toktype])
+            offsets_append(start)
+            ends_append(m.end())
+            lines_append(scratch.lineno if func else self.lineno)
+
+        self.lexpos = pos
+        if not binary:
+            tokens.to_bytes()
+        return tokens
+
+
+_non_ascii = re.compile(rb'[\x80-\xff]')
+
+
+def bytes_ignore():
+    # the lexer's blanks, plus the CR a text-mode read would have dropped
+    return get_lexer().lexignore.encode() + b'\r'
+
+
+_bulk_scanners = {}
+
+
+def get_bulk_scanners(kind=bytes):
+    # the master regexes of the shared lexer, for bytes or str buffers, each
+    # also skipping leading ignored characters, and the last one also
+    # matching a literal in a group of its own
+    if kind not in _bulk_scanners:
+        lexer = get_lexer()
+        ignore = '[' + re.escape(bytes_ignore().decode()) + ']*'
+        literals = '|([' + re.escape(''.join(lexer.lexliterals)) + '])' if lexer.lexliterals else ''
+        scanners = []
+        for i, (lexre, lexindexfunc) in enumerate(lexer.lexre):
+            pattern = ignore + '(?:' + lexre.pattern + (literals if i == len(lexer.lexre) - 1 else '') + ')'
+            if kind is bytes:
+                scanners.append((re.compile(pattern.encode(), lexre.flags & ~re.UNICODE), lexindexfunc))
+            else:
+                scanners.append((re.compile(pattern, lexre.flags), lexindexfunc))
+        _bulk_scanners[kind] = scanners
+    return _bulk_scanners[kind]
+
+
+_token_names = None
+
+
+def token_names():
+    # token type ids index this list: the lexer's token names, then its literals
+    global _token_names
+    if _token_names is None:
+        lexer = get_lexer()
+        _token_names = sorted(lexer.lextokens) + sorted(lexer.lexliterals)
+    return _token_names
+
+
+class TokenArrays:
+    """A lexed buffer as parallel arrays rather than one LexToken per token.
+
+    `types` holds ids into `names`, `offsets` and `ends` the byte span of
+    each token.  Values are sliced and decoded from the buffer only when
+    asked for, except the few a rule computes (numbers), which are kept in
+    `values`.  `lines` holds the line each token starts on.
+    """
+
+    def __init__(self, data, lineno, names):
+        self.data = data
+        self.lineno = lineno
+        self.names = names
+        self.types = array('H')
+        self.offsets = array('I')
+        self.ends = array('I')
+        self.lines = array('I')
+        self.values = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def value(self, i):
+        if i in self.values:
+            return self.values[i]
+        return self.data[self.offsets[i]:self.ends[i]].decode()
+
+    def token(self, i):
+        tok = lex.LexToken()
+        tok.type = self.names[self.types[i]]
+        tok.value = self.value(i)
+        tok.lineno = self.lines[i]
+        tok.lexpos = self.offsets[i]
+        return tok
+
+    def to_bytes(self):
+        # offsets into lexed text become offsets into its UTF-8 encoding
+        text = self.data
+        offsets = self.offsets
+        ends = self.ends
+        char = byte = 0
+        for i in range(len(self.types)):
+            for positions in (offsets, ends):
+                byte += len(text[char:positions[i]].encode())
+                char = positions[i]
+                positions[i] = byte
+        self.data = text.encode()
+
+
+def tokenize_all(data, lineno=1):
+    """Lex all of `data` (bytes or an mmap) into a TokenArrays."""
+    if _non_ascii.search(data):
+        # the rules' \w and \d match more than ASCII, as they do under ply
+        data = str(data, 'utf-8')
+    return BytesLexer(data, lineno).tokenize_all()
+
+
+class Production(list):
+    """What a grammar rule sees as `p` under parse_tokens(): the values of its symbols.
+
+    p.lineno(n) is the line symbol n starts on, for nonterminals too.
+    """
+
+    __slots__ = ('lines', 'base')
+
+    def lineno(self, n):
+        return self.lines[self.base + n]
+
+
+def parse_tokens(tokens):
+    """Run the LR parser straight over a TokenArrays and return the tree.
+
+    This is ply's parse loop with stacks of plain values and line numbers
+    instead of YaccSymbol objects.  p_error raises on the first error, so
+    there is no error recovery to carry over.
+    """
+    parser = get_parser()
+    actions = parser.action
+    goto = parser.goto
+    productions = parser.productions
+    defaulted_states = parser.defaulted_states
+    names = tokens.names
+    types = tokens.types
+    offsets = tokens.offsets
+    ends = tokens.ends
+    lines = tokens.lines
+    values = tokens.values
+    data = tokens.data
+    count = len(types)
+
+    statestack = [0]
+    valuestack = [None]
+    linestack = [tokens.lineno]
+    state = 0
+    i = 0
+    ltype = None
+    while True:
+        if state in defaulted_states:
+            t = defaulted_states[state]
+        else:
+            if ltype is None:
+                ltype = names[types[i]] if i < count else '$end'
+            t = actions[state].get(ltype)
+            if t is None:
+                p_error(tokens.token(i) if i < count else None)
+
+        if t > 0:
+            statestack.append(t)
+            state = t
+            valuestack.append(values[i] if i in values else data[offsets[i]:ends[i]].decode())
+            linestack.append(lines[i])
+            i += 1
+            ltype = None
+        elif t < 0:
+            rule = productions[-t]
+            plen = rule.len
+            if plen:
+                p = Production(valuestack[-plen - 1:])
+                p[0] = None
+                p.lines = linestack
+                p.base = len(linestack) - plen - 1
+                rule.callable(p)
+                line = linestack[p.base + 1]
+                del valuestack[-plen:]
+                del linestack[-plen:]
+                del statestack[-plen:]
+            else:
+                p = Production([None])
+                p.lines = linestack
+                p.base = len(linestack) - 1
+                rule.callable(p)
+                line = linestack[-1]
+            valuestack.append(p[0])
+            linestack.append(line)
+            state = goto[statestack[-1]][rule.name]
+            statestack.append(state)
+        else:
+            return valuestack[-1]
+
+
+# what split_units() needs to see of the source: braces and semicolons, and
+# the comments, strings and character constants that may hide them
+_unit_comment = r"""/\*.*?\*/|//[^\n]*|\#[^\n]*"""
+_unit_tokens = (r"""(?P<comment>""" + _unit_comment + r""")|(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')"""
+                r"""|(?P<open>\{)|(?P<close>\})|(?P<semi>;)""")
+_unit_gap = r"""(?:\s|""" + _unit_comment + r""")*\Z"""
+# one set for source text and one for raw or memory-mapped bytes
+_unit_scanner = {str: re.compile(_unit_tokens, re.DOTALL), bytes: re.compile(_unit_tokens.encode(), re.DOTALL)}
+_unit_gap_re = {str: re.compile(_unit_gap, re.DOTALL), bytes: re.compile(_unit_gap.encode(), re.DOTALL)}
+
+
+def split_units(text):
+    """Yield the end offset of every top-level unit in `text` (a str or bytes-like).
+
+    A unit ends at a ';' or at the '}' closing a function body; an array
+    initializer's '}' is followed by the declaration's ';'.
+    """
+    kind = str if isinstance(text, str) else bytes
+    gap = _unit_gap_re[kind]
+    depth = 0
+    closed = None
+    for m in _unit_scanner[kind].finditer(text):
+        c = m.lastgroup
+        if closed is not None:
+            if c == 'comment':
+                continue
+            if c != 'semi' or not gap.match(text, closed, m.start()):
+                yield closed
+            closed = None
+        if c == 'open':
+            depth += 1
+        elif c == 'close':
+            depth -= 1
+            if depth == 0:
+                closed = m.end()
+        elif c == 'semi' and depth == 0:
+            yield m.end()
+    if closed is not None:
+        yield closed
+
+
+def iter_units(text, stats=None, unit_cache=None):
+    """Parse `text` one top-level unit at a time, yielding each unit's subtree.
+
+    Only the unit being parsed is held in memory.  `text` may also be bytes
+    or an mmap, which is lexed with a BytesLexer without decoding it as a
+    whole.  With a UnitCache, units whose text was parsed before are not
+    parsed again.
+    """
+    if stats is not None:
+        stats.setdefault('tokens', 0)
+        stats.setdefault('units_reused', 0)
+
+    binary = not isinstance(text, str)
+    newline = b'\n' if binary else '\n'
+    start = 0
+    lineno = 1
+    empty = True
+    for end in itertools.chain(split_units(text), [len(text)]):
+        unit = text[start:end]
+        trees = None
+        if unit_cache is not None:
+            key = hashlib.sha256(unit if binary else unit.encode()).digest()
+            entry = unit_cache.get(key)
+            if entry is not None:
+                # the same text may start on another line than when it was cached
+                first_line, trees = entry
+                if first_line != lineno:
+                    trees = [shifted(tree, lineno - first_line) for tree in trees]
+                if stats is not None:
+                    stats['units_reused'] += 1
+        if trees is None:
+            tokens = tokenize_all(unit if binary else unit.encode(), lineno)
+            if stats is not None:
+                stats['tokens'] += len(tokens)
+            # trailing blanks and comments are no unit, but an empty file
+            # still has to fail the way the grammar says
+            if tokens or empty:
+                trees = parse_tokens(tokens)
+                if unit_cache is not None:
+                    unit_cache.put(key, (lineno, trees))
+        if trees is not None:
+            empty = False
+            yield from trees
+        lineno += unit.count(newline)
+        start = end
+
+
+def parse(text, stats=None, unit_cache=None):
+    if unit_cache is not None:
+        return list(iter_units(text, stats, unit_cache))
+
+    tokens = tokenize_all(text if isinstance(text, (bytes, bytearray)) else text.encode())
+    if stats is not None:
+        stats['tokens'] = stats.get('tokens', 0) + len(tokens)
+    return parse_tokens(tokens)
+
+
+def count_nodes(ast):
+    # nodes and the lists holding sequences
+    return sum(1 for item in walk(ast) if isinstance(item, (Node, list)))
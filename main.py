@@ -1,23 +1,241 @@
 #!/usr/bin/python3
 
+import argparse
+import io
 import sys
-from frontend import yacc, ParseException
-from backend import parse
+import frontend
+from frontend import ParseException
+import backend
+from cache import atomic_path
+import compiler
+from compiler import compile_file, init_worker, cache_key, map_source, CompileCache
+from timing import PhaseTimer
 
-if __name__ == "__main__":
 
-    text = open(sys.argv[1], "r")
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='C to MIPS compiler')
+    arg_parser.add_argument('files', nargs='*', metavar='file',
+                            help='SOURCE OUTPUT, or the sources to compile with --batch')
+    arg_parser.add_argument('--production', action='store_true',
+                            help='trust the cached parse tables and skip grammar validation '
+                                 '(same as CC_PRODUCTION=1)')
+    arg_parser.add_argument('--time-phases', action='store_true',
+                            help='report per-phase timings and counters to stderr')
+    arg_parser.add_argument('--time-phases-json', metavar='FILE',
+                            help='write the per-phase timings and counters to FILE as JSON')
+    arg_parser.add_argument('--batch', action='store_true',
+                            help='compile every source in one process, writing each .s next to its input')
+    arg_parser.add_argument('--manifest', metavar='FILE',
+                            help='with --batch, read more sources from FILE (one path per line)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                            help='with --batch, compile on N worker processes and stop at the first error')
+    arg_parser.add_argument('--fork-server', action='store_true',
+                            help='read "SOURCE [OUTPUT]" lines from stdin and compile each in a forked '
+                                 'child of one warm process (-j N children at a time)')
+    arg_parser.add_argument('--watch', action='store_true',
+                            help='keep running and recompile SOURCE into OUTPUT whenever it changes')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='generate code for each function as soon as it is parsed instead of '
+                                 'building the whole tree first, lexing the memory-mapped source '
+                                 '(no "ast" dump; for very large inputs)')
+    arg_parser.add_argument('--no-timestamp', dest='timestamp', action='store_false',
+                            help='leave out the "# Generated at" header so the output is reproducible')
+    arg_parser.add_argument('--cache', action='store_true',
+                            help='reuse assembly from the on-disk compile cache for identical inputs '
+                                 '(implies --no-timestamp)')
+    args = arg_parser.parse_args()
+    if args.cache:
+        args.timestamp = False
+    if args.fork_server:
+        if args.files or args.batch:
+            arg_parser.error('--fork-server takes its sources from stdin')
+        return args
+    if args.watch and (args.batch or args.jobs > 1):
+        arg_parser.error('--watch compiles a single SOURCE OUTPUT pair')
+    if args.jobs > 1:
+        args.batch = True
+    if args.manifest and not args.batch:
+        arg_parser.error('--manifest requires --batch')
+    if not args.batch and len(args.files) != 2:
+        arg_parser.error('expected SOURCE OUTPUT')
+    return args
+
+
+def compile_one(source, output, time_phases=None, timestamp=True, cache=None, stream=False):
+    timer = PhaseTimer()
+    counters = {} if time_phases else None
+
+    with timer.phase('read'):
+        if stream:
+            # large inputs are lexed straight from the page cache
+            text = map_source(source)
+        else:
+            text = open(source, "r").read()
+
+    if cache is not None:
+        with timer.phase('cache'):
+            key = cache_key(text, filename=source, timestamp=False)
+            cached = cache.get(key)
+            if cached is not None:
+                with open(output, 'wb') as asm:
+                    asm.write(cached)
+        if cached is not None:
+            if time_phases:
+                timer.count('cache_hit', 1)
+                timer.report(time_phases)
+            return
+
+    with timer.phase('setup'):
+        frontend.warm_up()
+
+    if stream:
+        if not compile_stream(source, output, text, timer, counters, timestamp):
+            return
+        if cache is not None:
+            with open(output, 'rb') as f:
+                cache.put(key, f.read())
+        if time_phases:
+            timer.report(time_phases)
+        return
 
     try:
-        ast = yacc.parse(text.read())
+        with timer.phase('parse'):
+            ast = frontend.parse(text, stats=counters)
     except ParseException as e:
         print(e)
-    else:
+        return
+
+    with timer.phase('ast'):
         ast_file = open('ast', 'w')
         ast_file.write(str(ast))
+        ast_file.close()
+
+    with timer.phase('codegen'):
+        codegen = backend.CodeGen()
+        instructions = codegen.generate(ast)
+
+    with timer.phase('write'):
+        asm = io.StringIO()
+        asm.write('# Generated from: ' + source + '\n')
+        backend.write(instructions, asm, timestamp)
+        with open(output, 'w+') as f:
+            f.write(asm.getvalue())
+        if cache is not None:
+            cache.put(key, asm.getvalue().encode())
+
+    if time_phases:
+        timer.count('tokens', counters['tokens'])
+        timer.count('ast_nodes', frontend.count_nodes(ast))
+        for name, value in codegen.stats(instructions).items():
+            timer.count(name, value)
+        timer.report(time_phases)
+
+
+def compile_stream(source, output, text, timer, counters=None, timestamp=True):
+    # parse and codegen interleave unit by unit, so they are timed as one phase
+    codegen = backend.CodeGen()
+    try:
+        with timer.phase('compile'), atomic_path(output) as tmp, open(tmp, 'w') as asm:
+            asm.write('# Generated from: ' + source + '\n')
+            count = codegen.generate_stream(frontend.iter_units(text, counters), asm, timestamp)
+    except ParseException as e:
+        print(e)
+        return False
+
+    if counters is not None:
+        timer.count('tokens', counters['tokens'])
+        stats = codegen.stats(())
+        stats['instructions'] = count
+        for name, value in stats.items():
+            timer.count(name, value)
+    return True
+
+
+def batch_sources(files, manifest=None):
+    sources = list(files)
+    if manifest:
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    sources.append(line)
+    return sources
+
+
+def compile_batch(sources, cache=None, timestamp=True):
+    # one warm parser for the whole batch; a failure only skips its own file
+    frontend.warm_up()
+    failed = 0
+    for source in sources:
+        try:
+            compile_file(source, cache=cache, timestamp=timestamp)
+        except Exception as e:
+            failed += 1
+            print(f'{source}: {e}', file=sys.stderr)
+    print(f'{len(sources) - failed} compiled, {failed} failed', file=sys.stderr)
+    return failed
+
+
+def compile_chunk(sources, timestamp=True):
+    for source in sources:
+        try:
+            compile_file(source, cache=compiler.worker_cache, timestamp=timestamp)
+        except Exception as e:
+            return f'{source}: {e}'
+    return None
+
+
+def compile_parallel(sources, jobs, use_cache=False, timestamp=True):
+    # imported here: a single compile should not pay for multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    # warm up before the pool starts so forked workers inherit the tables
+    frontend.warm_up()
+    # small files are sent in chunks to keep the per-task IPC cost down
+    size = max(1, min(32, len(sources) // (jobs * 4)))
+    chunks = [sources[i:i + size] for i in range(0, len(sources), size)]
+
+    pool = ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(frontend.production, use_cache))
+    try:
+        futures = [pool.submit(compile_chunk, chunk, timestamp) for chunk in chunks]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            errors = [f.result() for f in futures if f in done and f.result() is not None]
+            if errors:
+                print(errors[0], file=sys.stderr)
+                return 1
+    finally:
+        pool.shutdown(cancel_futures=True)
+    print(f'{len(sources)} compiled', file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.production:
+        frontend.production = True
+
+    if args.fork_server:
+        import forkserver
+        forkserver.serve(jobs=args.jobs)
+        sys.exit(0)
 
-        asm = open(sys.argv[2], 'w+')
-        asm.write('# Generated from: ' + sys.argv[1] + '\n')
+    if args.batch:
+        sources = batch_sources(args.files, args.manifest)
+        if args.jobs > 1:
+            sys.exit(compile_parallel(sources, args.jobs, args.cache, args.timestamp))
+        cache = CompileCache() if args.cache else None
+        sys.exit(1 if compile_batch(sources, cache, args.timestamp) else 0)
 
-        parse(ast, asm)
+    if args.watch:
+        import watch
+        try:
+            watch.watch(args.files[0], args.files[1], timestamp=args.timestamp)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
 
+    cache = CompileCache() if args.cache else None
+    time_phases = args.time_phases_json or ('-' if args.time_phases else None)
+    compile_one(args.files[0], args.files[1], time_phases, args.timestamp, cache, args.stream)
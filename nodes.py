@@ -0,0 +1,357 @@
+"""Syntax tree nodes built by the frontend and consumed by the backend.
+
+Leaves are plain values: ints for numbers and strs for names, types and
+operators.  Sequences (the units of a file, statements, arguments,
+parameters) are flat lists.  Every node records the line it starts on.
+"""
+
+
+class Node:
+    __slots__ = ('lineno',)
+    fields = ()
+
+    def __repr__(self):
+        return dump(self)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, f) == getattr(other, f) for f in self.fields)
+
+    __hash__ = None
+
+
+class FunDef(Node):
+    """A function definition; `params` is None for an empty parameter list."""
+
+    __slots__ = fields = ('type', 'name', 'params', 'body')
+
+    def __init__(self, type, name, params, body, lineno=0):
+        self.type = type
+        self.name = name
+        self.params = params
+        self.body = body
+        self.lineno = lineno
+
+
+class Decl(Node):
+    """A scalar declaration; `init` is None without an initializer."""
+
+    __slots__ = fields = ('type', 'name', 'init')
+
+    def __init__(self, type, name, init, lineno=0):
+        self.type = type
+        self.name = name
+        self.init = init
+        self.lineno = lineno
+
+
+class ArrayDecl(Node):
+    """An array declaration; `values` is None without an initializer list."""
+
+    __slots__ = fields = ('type', 'name', 'size', 'values')
+
+    def __init__(self, type, name, size, values, lineno=0):
+        self.type = type
+        self.name = name
+        self.size = size
+        self.values = values
+        self.lineno = lineno
+
+
+class Call(Node):
+    """A function call; `args` is None without arguments."""
+
+    __slots__ = fields = ('name', 'args')
+
+    def __init__(self, name, args, lineno=0):
+        self.name = name
+        self.args = args
+        self.lineno = lineno
+
+
+class Asm(Node):
+    """An ``asm("...")`` statement; `code` keeps its quotes."""
+
+    __slots__ = fields = ('code',)
+
+    def __init__(self, code, lineno=0):
+        self.code = code
+        self.lineno = lineno
+
+
+class PrintStr(Node):
+    """A ``printstr("...")`` statement; `text` keeps its quotes."""
+
+    __slots__ = fields = ('text',)
+
+    def __init__(self, text, lineno=0):
+        self.text = text
+        self.lineno = lineno
+
+
+class Return(Node):
+    """A return statement; `value` is None for a bare ``return;``."""
+
+    __slots__ = fields = ('value',)
+
+    def __init__(self, value, lineno=0):
+        self.value = value
+        self.lineno = lineno
+
+
+class Break(Node):
+    """A break statement."""
+
+    __slots__ = fields = ()
+
+    def __init__(self, lineno=0):
+        self.lineno = lineno
+
+
+class Continue(Node):
+    """A continue statement."""
+
+    __slots__ = fields = ()
+
+    def __init__(self, lineno=0):
+        self.lineno = lineno
+
+
+class If(Node):
+    __slots__ = fields = ('cond', 'body')
+
+    def __init__(self, cond, body, lineno=0):
+        self.cond = cond
+        self.body = body
+        self.lineno = lineno
+
+
+class IfElse(Node):
+    __slots__ = fields = ('cond', 'body', 'orelse')
+
+    def __init__(self, cond, body, orelse, lineno=0):
+        self.cond = cond
+        self.body = body
+        self.orelse = orelse
+        self.lineno = lineno
+
+
+class While(Node):
+    __slots__ = fields = ('cond', 'body')
+
+    def __init__(self, cond, body, lineno=0):
+        self.cond = cond
+        self.body = body
+        self.lineno = lineno
+
+
+class DoWhile(Node):
+    __slots__ = fields = ('cond', 'body')
+
+    def __init__(self, cond, body, lineno=0):
+        self.cond = cond
+        self.body = body
+        self.lineno = lineno
+
+
+class For(Node):
+    __slots__ = fields = ('init', 'cond', 'step', 'body')
+
+    def __init__(self, init, cond, step, body, lineno=0):
+        self.init = init
+        self.cond = cond
+        self.step = step
+        self.body = body
+        self.lineno = lineno
+
+
+class Assign(Node):
+    __slots__ = fields = ('name', 'value')
+
+    def __init__(self, name, value, lineno=0):
+        self.name = name
+        self.value = value
+        self.lineno = lineno
+
+
+class ArrayAssign(Node):
+    __slots__ = fields = ('name', 'index', 'value')
+
+    def __init__(self, name, index, value, lineno=0):
+        self.name = name
+        self.index = index
+        self.value = value
+        self.lineno = lineno
+
+
+class PtrAssign(Node):
+    """An assignment through a pointer, ``*name = value``."""
+
+    __slots__ = fields = ('name', 'value')
+
+    def __init__(self, name, value, lineno=0):
+        self.name = name
+        self.value = value
+        self.lineno = lineno
+
+
+class BinOp(Node):
+    __slots__ = fields = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right, lineno=0):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.lineno = lineno
+
+
+class Cond(Node):
+    """A comparison or logical operator; it evaluates to the label jumped to when false."""
+
+    __slots__ = fields = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right, lineno=0):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.lineno = lineno
+
+
+class Not(Node):
+    __slots__ = fields = ('operand',)
+
+    def __init__(self, operand, lineno=0):
+        self.operand = operand
+        self.lineno = lineno
+
+
+class UMinus(Node):
+    __slots__ = fields = ('operand',)
+
+    def __init__(self, operand, lineno=0):
+        self.operand = operand
+        self.lineno = lineno
+
+
+class Id(Node):
+    __slots__ = fields = ('name',)
+
+    def __init__(self, name, lineno=0):
+        self.name = name
+        self.lineno = lineno
+
+
+class ArrayRef(Node):
+    __slots__ = fields = ('name', 'index')
+
+    def __init__(self, name, index, lineno=0):
+        self.name = name
+        self.index = index
+        self.lineno = lineno
+
+
+class Address(Node):
+    __slots__ = fields = ('name',)
+
+    def __init__(self, name, lineno=0):
+        self.name = name
+        self.lineno = lineno
+
+
+class ArrayAddress(Node):
+    __slots__ = fields = ('name', 'index')
+
+    def __init__(self, name, index, lineno=0):
+        self.name = name
+        self.index = index
+        self.lineno = lineno
+
+
+class Deref(Node):
+    __slots__ = fields = ('name',)
+
+    def __init__(self, name, lineno=0):
+        self.name = name
+        self.lineno = lineno
+
+
+class Char(Node):
+    """A character constant; `value` keeps its quotes."""
+
+    __slots__ = fields = ('value',)
+
+    def __init__(self, value, lineno=0):
+        self.value = value
+        self.lineno = lineno
+
+
+def walk(tree):
+    """Yield every node, sequence and leaf of `tree` in pre-order, without recursion."""
+    stack = [tree]
+    while stack:
+        item = stack.pop()
+        yield item
+        if isinstance(item, Node):
+            stack.extend(getattr(item, f) for f in reversed(item.fields))
+        elif type(item) is list:
+            stack.extend(reversed(item))
+
+
+def shifted(tree, delta):
+    """Return a copy of `tree` with every line number moved by `delta`; leaves are shared."""
+    holder = [tree]
+    stack = [(holder, 0)]
+    while stack:
+        parent, key = stack.pop()
+        item = parent[key] if type(key) is int else getattr(parent, key)
+        if isinstance(item, Node):
+            copy = object.__new__(type(item))
+            copy.lineno = item.lineno + delta
+            for f in item.fields:
+                setattr(copy, f, getattr(item, f))
+                stack.append((copy, f))
+        elif type(item) is list:
+            copy = list(item)
+            stack.extend((copy, i) for i in range(len(copy)))
+        else:
+            continue
+        if type(key) is int:
+            parent[key] = copy
+        else:
+            setattr(parent, key, copy)
+    return holder[0]
+
+
+class _Text(str):
+    """Punctuation queued by dump(), as opposed to a leaf to repr()."""
+
+    __slots__ = ()
+
+
+_SEP = _Text(', ')
+
+
+def dump(tree):
+    """Return the repr of `tree`; unlike the builtin it copes with any nesting depth."""
+    parts = []
+    stack = [tree]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, Node):
+            parts.append(type(item).__name__ + '(')
+            stack.append(_Text(')'))
+            items = [getattr(item, f) for f in item.fields]
+        elif type(item) is list:
+            parts.append('[')
+            stack.append(_Text(']'))
+            items = item
+        elif type(item) is _Text:
+            parts.append(item)
+            continue
+        else:
+            parts.append(repr(item))
+            continue
+        for i in range(len(items) - 1, -1, -1):
+            stack.append(items[i])
+            if i:
+                stack.append(_SEP)
+    return ''.join(parts)
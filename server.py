@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from contextlib import redirect_stdout
+
+import backend
+import frontend
+from client import default_socket
+from compiler import compile_string
+
+# compiles are CPU bound and the lexer reports problems with print(), so they
+# run one at a time with stdout captured as the request's diagnostics
+compile_lock = threading.Lock()
+# clients tend to resend the same files with small edits
+unit_cache = frontend.UnitCache()
+fun_cache = backend.FunctionCache()
+
+
+def handle_request(request):
+    response = {'asm': None, 'error': None}
+    diagnostics = io.StringIO()
+    with compile_lock, redirect_stdout(diagnostics):
+        try:
+            response['asm'] = compile_string(request['source'], filename=request.get('filename'),
+                                             unit_cache=unit_cache, fun_cache=fun_cache)
+        except Exception as e:
+            response['error'] = str(e)
+    response['diagnostics'] = diagnostics.getvalue().splitlines()
+    return response
+
+
+class CompileHandler(socketserver.StreamRequestHandler):
+    # one JSON object per line each way; a connection may send many requests
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = handle_request(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                response = {'asm': None, 'error': f'bad request: {e}', 'diagnostics': []}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise RuntimeError(f'a compile server is already listening on {path}')
+
+
+def serve(path=None):
+    path = path or default_socket()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    remove_stale_socket(path)
+    frontend.warm_up()
+    # let `kill` run the cleanup below instead of leaving the socket behind
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with CompileServer(path, CompileHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='C to MIPS compile server')
+    arg_parser.add_argument('--socket', metavar='PATH', help='Unix socket to listen on (default: %(default)s)',
+                            default=default_socket())
+    arg_parser.add_argument('--production', action='store_true',
+                            help='trust the cached parse tables and skip grammar validation')
+    args = arg_parser.parse_args()
+    if args.production:
+        frontend.production = True
+    try:
+        serve(args.socket)
+    except KeyboardInterrupt:
+        pass
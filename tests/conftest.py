@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# keep parser tables and compile caches out of the user's cache directory
+os.environ['CC_CACHE_DIR'] = tempfile.mkdtemp(prefix='cc-test-cache-')
@@ -0,0 +1,91 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import compiler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def example(name):
+    with open(os.path.join(ROOT, 'examples', name)) as f:
+        return f.read()
+
+
+def without_timestamp(asm):
+    return ''.join(line for line in asm.splitlines(True) if not line.startswith('# Generated at: '))
+
+
+@pytest.fixture
+def service(tmp_path):
+    path = str(tmp_path / 'cc.sock')
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', os.path.join(ROOT, 'aioserver.py'),
+                                '--socket', path, '-j', '2'], env=os.environ)
+    try:
+        # the socket file appears before the server listens on it
+        for _ in range(200):
+            try:
+                with socket.socket(socket.AF_UNIX) as probe:
+                    probe.connect(path)
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield path
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def exchange(path, lines):
+    """Send every line on one connection before reading any reply, and return the replies."""
+    client = socket.socket(socket.AF_UNIX)
+    client.settimeout(30)
+    client.connect(path)
+    with client, client.makefile('rb') as replies:
+        for line in lines:
+            client.sendall(line + b'\n')
+        client.shutdown(socket.SHUT_WR)
+        return [json.loads(line) for line in replies]
+
+
+def test_pipelined_requests_match_direct_compiles(service):
+    sources = [example(name) for name in ('while.c', 'quick_sort.c', 'syntax_error.c')] * 2
+    requests = [json.dumps({'id': n, 'source': source, 'filename': f'{n}.c'}).encode()
+                for n, source in enumerate(sources)]
+    answers = exchange(service, requests + [b'not json'])
+
+    assert len(answers) == len(sources) + 1
+    assert [a for a in answers if 'id' not in a][0]['error'].startswith('bad request')
+    by_id = {a['id']: a for a in answers if 'id' in a}
+    for n, source in enumerate(sources):
+        try:
+            expected = compiler.compile_string(source, filename=f'{n}.c', timestamp=False)
+        except Exception as e:
+            assert by_id[n]['asm'] is None
+            assert by_id[n]['error'] == str(e)
+        else:
+            assert by_id[n]['error'] is None
+            assert without_timestamp(by_id[n]['asm']) == expected
+
+
+def test_requests_that_are_not_objects_get_bad_request(service):
+    source = example('while.c')
+    answers = exchange(service, [
+        json.dumps({'id': 1, 'source': source}).encode(),
+        b'[1, 2]',
+        b'5',
+        json.dumps({'id': 2, 'source': source}).encode(),
+        b'{"op": "stats"}',
+    ])
+    assert len(answers) == 5
+    errors = [a['error'] for a in answers if 'id' not in a and 'error' in a]
+    assert len(errors) == 2
+    assert all(error.startswith('bad request') for error in errors)
+    by_id = {a['id']: a for a in answers if 'id' in a}
+    assert by_id[1]['asm'] is not None and by_id[2]['asm'] is not None
+    assert any('completed' in a for a in answers)
@@ -0,0 +1,261 @@
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import backend
+import compiler
+import frontend
+
+F = '''int f(int n) {
+  int i;
+  i = 0;
+  while (i < n) {
+    if (i == 3) {
+      break;
+    }
+    i = i + 1;
+  }
+  return i;
+}
+'''
+
+G = '''int g(int n) {
+  if (n > 0) {
+    return 1;
+  } else {
+    return 0;
+  }
+}
+'''
+
+MAIN = '''int main() {
+  int x;
+  x = f(5) + g(1);
+}
+'''
+
+LABEL = re.compile(r'^(\w+):$', re.M)
+BRANCH = re.compile(r'^(?:j|jal|b\w+ .*,) ?(\w+)$', re.M)
+
+
+def assemble(asm, tmp_path):
+    """Check that `asm` would assemble: every label defined once, every jump resolved."""
+    labels = LABEL.findall(asm)
+    assert len(labels) == len(set(labels))
+    for target in BRANCH.findall(asm):
+        assert target in labels
+    spim = shutil.which('spim')
+    if spim:
+        path = tmp_path / 'out.s'
+        path.write_text(asm)
+        result = subprocess.run([spim, '-file', str(path)], capture_output=True, text=True)
+        assert 'error' not in (result.stdout + result.stderr).lower()
+    return labels
+
+
+def function(asm, name):
+    return re.search(rf'^{name}:\n(.*?)(?:\n\n|\Z)', asm, re.M | re.S).group(1)
+
+
+class CountingCache(backend.FunctionCache):
+    hits = 0
+
+    def get(self, key):
+        entry = super().get(key)
+        self.hits += entry is not None
+        return entry
+
+
+def test_labels_are_numbered_per_function(tmp_path):
+    # f and g both count from 1: only the function name keeps them apart
+    asm = compiler.compile_string(F + G + MAIN, timestamp=False)
+    labels = assemble(asm, tmp_path)
+    assert sorted(lbl for lbl in labels if '_lbl' in lbl) == ['f_lbl1', 'f_lbl2', 'f_lbl3', 'g_lbl1', 'g_lbl2']
+    # and a function's labels do not depend on what was generated before it
+    swapped = compiler.compile_string(G + F + MAIN, timestamp=False)
+    for name in ('f', 'g'):
+        assert function(swapped, name) == function(asm, name)
+
+
+def test_reused_functions_keep_unique_labels(tmp_path):
+    fun_cache = CountingCache()
+    unit_cache = frontend.UnitCache()
+    first = compiler.compile_string(F + G + MAIN, timestamp=False, fun_cache=fun_cache, unit_cache=unit_cache)
+    # the same units in another order: both functions come from the cache,
+    # after a different predecessor than the one they were generated after
+    second = compiler.compile_string(G + F + MAIN, timestamp=False, fun_cache=fun_cache, unit_cache=unit_cache)
+    assert fun_cache.hits >= 2
+    assert assemble(second, tmp_path)
+    for name in ('f', 'g'):
+        assert function(second, name) == function(first, name)
+    assert second == compiler.compile_string(G + F + MAIN, timestamp=False)
+
+
+LOOPS = '''int main() {
+  int i;
+  int j;
+  int n;
+  n = 0;
+  for (i = 0; i < 4; i = i + 1) {
+    if (i == 1) {
+      continue;
+    }
+    j = 0;
+    while (j < 3) {
+      j = j + 1;
+      if (j == 2) {
+        continue;
+      }
+      do {
+        n = n + 1;
+        if (n > 9) {
+          break;
+        }
+        continue;
+      } while (n < 5);
+      if (n > 20) {
+        break;
+      }
+    }
+  }
+}
+'''
+
+# continue in the for loop runs the step (main_lbl12) and in the do-while
+# tests the condition (main_lbl8); break leaves only the innermost loop
+LOOPS_ASM = '''.data
+.text
+
+main:
+addi $sp, $sp, -16
+sw $ra, 0($sp)
+sw $zero, 4($sp)
+sw $zero, 8($sp)
+sw $zero, 12($sp)
+li $t0,0
+sw $t0, 12($sp)
+li $t0,0
+sw $t0, 4($sp)
+main_lbl11:
+lw $t0, 4($sp)
+li $t1,4
+bge $t0, $t1, main_lbl1
+lw $t0, 4($sp)
+li $t1,1
+bne $t0, $t1, main_lbl2
+j main_lbl12
+main_lbl2:
+li $t0,0
+sw $t0, 8($sp)
+main_lbl10:
+lw $t0, 8($sp)
+li $t1,3
+bge $t0, $t1, main_lbl3
+lw $t0, 8($sp)
+addi $t0, $t0, 1
+sw $t0, 8($sp)
+lw $t0, 8($sp)
+li $t1,2
+bne $t0, $t1, main_lbl4
+j main_lbl10
+main_lbl4:
+main_lbl7:
+lw $t0, 12($sp)
+addi $t0, $t0, 1
+sw $t0, 12($sp)
+lw $t0, 12($sp)
+li $t1,9
+ble $t0, $t1, main_lbl6
+j main_lbl5
+main_lbl6:
+j main_lbl8
+main_lbl8:
+lw $t0, 12($sp)
+li $t1,5
+bge $t0, $t1, main_lbl5
+j main_lbl7
+main_lbl5:
+lw $t0, 12($sp)
+li $t1,20
+ble $t0, $t1, main_lbl9
+j main_lbl3
+main_lbl9:
+j main_lbl10
+main_lbl3:
+main_lbl12:
+lw $t0, 4($sp)
+addi $t0, $t0, 1
+sw $t0, 4($sp)
+j main_lbl11
+main_lbl1:
+lw $ra, 0($sp)
+addi $sp, $sp, 16
+li $v0 10 #prgoram finished call terminate
+syscall
+
+'''
+
+
+def test_nested_loops_break_and_continue(tmp_path):
+    asm = compiler.compile_string(LOOPS, timestamp=False)
+    assemble(asm, tmp_path)
+    assert asm == LOOPS_ASM
+
+
+def test_flatten_resolves_fixups_in_nested_chunks():
+    loop = backend.Loop()
+    loop.start, loop.exit = 'L_start', 'L_exit'
+    code = ['a', ['b', [backend.Fixup('j ', 'exit', loop)], [], backend.Fixup('addi $sp, $sp, ', 'frame')],
+            backend.Fixup('j ', 'start', loop), 'c']
+    assert backend.flatten(code, 12) == ['a', 'b', 'j L_exit', 'addi $sp, $sp, 12', 'j L_start', 'c']
+
+    # nesting costs no interpreter stack
+    deep = ['last']
+    for n in range(100000):
+        deep = [str(n), deep]
+    assert backend.flatten(deep) == [str(n) for n in reversed(range(100000))] + ['last']
+
+
+PLACEHOLDERS = '''int SEND(int n) {
+  int i;
+  int total;
+  total = 0;
+  for (i = 0; i < n; i = i + 1) {
+    asm("j END");
+    asm("addi $sp, $sp, STACK");
+    if (i == 5) {
+      return total;
+    }
+    total = total + i;
+  }
+  return total;
+}
+int main() {
+  int x;
+  x = SEND(3);
+}
+'''
+
+
+def test_fixups_leave_other_text_alone():
+    # labels, function names and asm() text used to be rewritten if they
+    # contained the placeholder words the fixups replaced
+    asm = compiler.compile_string(PLACEHOLDERS, timestamp=False)
+    body = function(asm, 'SEND').splitlines()
+    assert 'j END' in body
+    assert 'addi $sp, $sp, STACK' in body
+    assert 'jal SEND' in asm
+    assert 'SEND_lbl1:' in body
+    # every return releases the frame the prologue set up
+    frame = body[0].rsplit('-', 1)[1]
+    releases = [line for line in body[1:] if line.startswith('addi $sp, $sp, ') and line != 'addi $sp, $sp, STACK']
+    assert len(releases) == 3
+    assert all(line == 'addi $sp, $sp, ' + frame for line in releases)
+
+
+@pytest.mark.parametrize('statement', ['break', 'continue'])
+def test_jump_outside_a_loop_names_the_line(statement):
+    with pytest.raises(Exception, match=f'{statement} outside of a loop at line 3'):
+        compiler.compile_string(f'int main() {{\n  int x;\n  {statement};\n}}\n')
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+import compiler
+from cache import DiskCache
+
+SOURCE = 'int main() {\n  int x;\n  x = 1;\n}\n'
+
+
+@pytest.fixture
+def compile_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('CC_CACHE_DIR', str(tmp_path))
+    compiled = []
+    compile_string = compiler.compile_string
+
+    def counting_compile_string(source, **kwargs):
+        compiled.append(source)
+        return compile_string(source, **kwargs)
+
+    monkeypatch.setattr(compiler, 'compile_string', counting_compile_string)
+    cache = compiler.CompileCache()
+    cache.compiled = compiled
+    return cache
+
+
+def test_compile_cache_hits_on_the_same_source(compile_cache):
+    first = compile_cache.compile(SOURCE, filename='a.c')
+    assert compile_cache.compile(SOURCE.encode(), filename='a.c') == first
+    assert len(compile_cache.compiled) == 1
+
+
+@pytest.mark.parametrize('source, filename', [
+    (SOURCE.replace('1', '2'), 'a.c'),
+    (SOURCE, 'b.c'),
+    (SOURCE.replace('\n', '\r\n').encode(), 'a.c'),
+])
+def test_compile_cache_misses_when_an_input_changes(compile_cache, source, filename):
+    compile_cache.compile(SOURCE, filename='a.c')
+    compile_cache.compile(source, filename=filename)
+    assert len(compile_cache.compiled) == 2
+
+
+def test_compile_cache_misses_after_a_compiler_change(compile_cache, monkeypatch):
+    compile_cache.compile(SOURCE)
+    monkeypatch.setattr(compiler, '_compiler_version', 'another compiler')
+    compile_cache.compile(SOURCE)
+    assert len(compile_cache.compiled) == 2
+
+
+def test_compiler_version_follows_the_sources(tmp_path, monkeypatch):
+    import backend
+
+    monkeypatch.setattr(compiler, '_compiler_version', None)
+    version = compiler.compiler_version()
+    assert compiler.compiler_version() == version
+
+    changed = tmp_path / 'backend.py'
+    with open(backend.__file__) as f:
+        changed.write_text(f.read() + '\n# changed\n')
+    monkeypatch.setattr(backend, '__file__', str(changed))
+    monkeypatch.setattr(compiler, '_compiler_version', None)
+    assert compiler.compiler_version() != version
+
+
+def test_cache_key_covers_options():
+    assert compiler.cache_key(SOURCE, timestamp=False) == compiler.cache_key(SOURCE.encode(), timestamp=False)
+    assert compiler.cache_key(SOURCE, timestamp=False) != compiler.cache_key(SOURCE, timestamp=True)
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setenv('CC_CACHE_DIR', str(tmp_path))
+    cache = DiskCache('test', max_bytes=300)
+    for n, key in enumerate(['aa1', 'bb2', 'cc3']):
+        cache.put(key, b'x' * 100)
+        os.utime(cache.entry(key), (n, n))
+    cache.get('aa1')
+    cache.put('dd4', b'x' * 100)
+    assert cache.get('bb2') is None
+    assert cache.get('cc3') is None
+    assert cache.get('aa1') == b'x' * 100
+    assert cache.get('dd4') == b'x' * 100
+    assert cache.size <= 270
+
+
+def test_disk_cache_without_a_directory(tmp_path, monkeypatch):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    monkeypatch.setenv('CC_CACHE_DIR', str(blocker))
+    cache = DiskCache('test', max_bytes=300)
+    cache.put('aa1', b'data')
+    assert cache.get('aa1') is None
+
+
+def test_disk_cache_keeps_its_size_without_scanning(tmp_path, monkeypatch):
+    monkeypatch.setenv('CC_CACHE_DIR', str(tmp_path))
+    DiskCache('test', max_bytes=1000).put('aa1', b'x' * 100)
+
+    def scan(self):
+        raise AssertionError('scanned the cache below its cap')
+    monkeypatch.setattr(DiskCache, 'entries', scan)
+    cache = DiskCache('test', max_bytes=1000)
+    cache.put('bb2', b'x' * 100)
+    # rewriting an entry replaces its size instead of adding to it
+    cache.put('aa1', b'x' * 50)
+    assert DiskCache('test', max_bytes=1000).read_size() == 150
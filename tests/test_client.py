@@ -0,0 +1,15 @@
+import os
+
+import client
+import server
+from cache import cache_root
+
+
+def test_client_and_server_agree_on_the_socket(tmp_path, monkeypatch):
+    monkeypatch.delenv('CC_SOCKET', raising=False)
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setenv('CC_CACHE_DIR', str(tmp_path))
+    assert client.default_socket() == os.path.join(cache_root(), 'c-compiler.sock')
+    assert server.default_socket() == client.default_socket()
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path / 'run'))
+    assert server.default_socket() == client.default_socket() == str(tmp_path / 'run' / 'c-compiler.sock')
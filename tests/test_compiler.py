@@ -0,0 +1,40 @@
+import compiler
+
+SOURCE = 'int main() {\n  int x;\n  x = 1;\n}\n'
+
+
+def test_crlf_bytes_compile_like_text(capsys):
+    expected = compiler.compile_string(SOURCE, timestamp=False)
+    for newline in (b'\r\n', b'\r'):
+        source = SOURCE.encode().replace(b'\n', newline)
+        assert compiler.compile_string(source, timestamp=False) == expected
+    assert 'Illegal character' not in capsys.readouterr().out
+
+
+def test_compile_file_reads_crlf_sources(tmp_path, capsys):
+    source = tmp_path / 'crlf.c'
+    source.write_bytes(SOURCE.encode().replace(b'\n', b'\r\n'))
+    asm_path = compiler.compile_file(str(source), timestamp=False)
+    with open(asm_path) as f:
+        asm = f.read()
+    assert asm.split('\n', 1)[1] == compiler.compile_string(SOURCE, timestamp=False)
+    assert 'Illegal character' not in capsys.readouterr().out
+
+
+def test_compiler_version_covers_every_module_that_shapes_output(monkeypatch):
+    import backend
+    import frontend
+    import nodes
+
+    hashed = []
+    real_open = open
+
+    def recording_open(path, *args, **kwargs):
+        hashed.append(path)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(compiler, '_compiler_version', None)
+    monkeypatch.setattr('builtins.open', recording_open)
+    compiler.compiler_version()
+    for module in (frontend, nodes, backend, compiler):
+        assert module.__file__ in hashed
@@ -0,0 +1,60 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import forkserver
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+
+def test_children_report_errors_and_keep_diagnostics(tmp_path):
+    good = tmp_path / 'good.c'
+    good.write_text('int main() {\n  int x;\n}\n')
+    noisy = tmp_path / 'noisy.c'
+    noisy.write_text('int main() {\n  int x $;\n}\n')
+    bad = tmp_path / 'bad.c'
+    bad.write_text('int main() {\n  int x\n}\n')
+    # a real process, so that stdout is a block-buffered pipe in the children
+    env = {k: v for k, v in os.environ.items() if k != 'PYTHONUNBUFFERED'}
+    result = subprocess.run([sys.executable, '-W', 'ignore', MAIN, '--fork-server'], cwd=tmp_path, env=env,
+                            input=f'{good}\n{noisy}\n{bad}\n', capture_output=True, text=True)
+
+    lines = result.stdout.splitlines()
+    assert f'ok {good}' in lines
+    assert f'ok {noisy}' in lines
+    assert any(line.startswith(f'error {bad}: ') for line in lines)
+    assert (tmp_path / 'good.s').exists()
+    # the child's lexer diagnostic survives os._exit
+    assert "Illegal character '$'" in result.stdout
+
+
+def test_exit_code_not_wait_status(tmp_path, monkeypatch):
+    def crash(source, output, error_fd):
+        forkserver.os._exit(1)
+
+    monkeypatch.setattr(forkserver, 'run_child', crash)
+    replies = io.StringIO()
+    forkserver.serve(io.StringIO(f'{tmp_path / "x.c"}\n'), replies)
+    assert replies.getvalue().strip().endswith('compiler exited with status 1')
+
+
+@pytest.mark.parametrize('exception', [KeyboardInterrupt, SystemExit])
+def test_child_exits_on_base_exceptions(tmp_path, monkeypatch, exception):
+    def interrupted(source, output):
+        raise exception()
+
+    monkeypatch.setattr(forkserver, 'compile_file', interrupted)
+    parent = os.getpid()
+    replies = io.StringIO()
+    try:
+        forkserver.serve(io.StringIO(f'{tmp_path / "x.c"}\n{tmp_path / "y.c"}\n'), replies)
+    finally:
+        if os.getpid() != parent:
+            # a child that unwound this far would go on running the tests
+            os._exit(99)
+    lines = replies.getvalue().splitlines()
+    assert len(lines) == 2
+    assert all(line.endswith('compiler exited with status 1') for line in lines)
@@ -0,0 +1,175 @@
+import os
+
+import pytest
+
+import frontend
+import nodes
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+
+def example(name):
+    with open(os.path.join(EXAMPLES, name)) as f:
+        return f.read()
+
+
+def ply_parse(text):
+    # parse_tokens() gives a rule's nonterminals the line of their first
+    # token, which ply only does with tracking on
+    return frontend.get_parser().parse(text, lexer=frontend.get_lexer().clone(), tracking=True)
+
+
+def lines(tree):
+    return [(type(n).__name__, n.lineno) for n in nodes.walk(tree) if isinstance(n, nodes.Node)]
+
+
+def ply_tokens(text):
+    lexer = frontend.get_lexer().clone()
+    lexer.input(text)
+    return [(tok.type, tok.value, tok.lineno) for tok in iter(lexer.token, None)]
+
+
+@pytest.mark.parametrize('name', ['while.c', 'quick_sort.c'])
+def test_token_arrays_match_ply_lexer(name):
+    text = example(name)
+    tokens = frontend.tokenize_all(text.encode())
+    assert [tuple(getattr(tok, a) for a in ('type', 'value', 'lineno'))
+            for tok in map(tokens.token, range(len(tokens)))] == ply_tokens(text)
+
+
+@pytest.mark.parametrize('name', ['while.c', 'quick_sort.c'])
+def test_parse_tokens_matches_ply_parser(name):
+    text = example(name)
+    tree = frontend.parse(text)
+    expected = ply_parse(text)
+    assert tree == expected
+    assert lines(tree) == lines(expected)
+
+
+def test_syntax_errors_match_ply_parser():
+    text = example('syntax_error.c')
+    with pytest.raises(frontend.ParseException) as ply_error:
+        ply_parse(text)
+    with pytest.raises(frontend.ParseException) as error:
+        frontend.parse(text)
+    assert str(error.value) == str(ply_error.value)
+
+
+def test_line_numbers():
+    tree = frontend.parse('int g;\nint main() {\n  int x;\n\n  x = 3 +\n 4;\n  while (x) { x--; }\n}\n')
+    found = [(type(n).__name__, n.lineno) for n in nodes.walk(tree) if isinstance(n, nodes.Node)]
+    assert found == [('Decl', 1), ('FunDef', 2), ('Decl', 3), ('Assign', 5), ('BinOp', 5),
+                     ('While', 7), ('Id', 7), ('Id', 7), ('Assign', 7), ('BinOp', 7), ('Id', 7)]
+
+
+
+@pytest.mark.parametrize('statement, order', [
+    ('x++', ['Id', 'Assign']), ('x--', ['Id', 'Assign']),
+    ('++x', ['Assign', 'Id']), ('--x', ['Assign', 'Id']),
+])
+def test_increments_are_statement_lists(statement, order):
+    tree = frontend.parse(f'int main() {{\n  int x;\n  {statement};\n}}\n')
+    increment = tree[0].body[-1]
+    assert type(increment) is list
+    assert [type(n).__name__ for n in increment] == order
+    assert not any(type(n) is tuple for n in nodes.walk(tree))
+
+
+GRAMMAR = '''int g = 3;
+int arr[4] = {1, 2, 3, 4};
+char ch = 'a';
+void h(int *p, int n) {
+  *p = n;
+  asm("nop");
+}
+int main() {
+  int x;
+  int y[3];
+  int *q;
+  x = -g + ~g * (g - 1) / 2 & 3 ^ 5 | 6;
+  x += 1; x -= 2; x *= 3; x /= 4; x &= 5; x ^= 6; x |= 7;
+  x++; x--; ++x; --x;
+  x = g > 1;
+  q = &x;
+  q = &y[1];
+  y[2] = *q;
+  h(q, x);
+  if (x <= 1 || x >= 2 && x != 3 || x == 4) {
+    printstr("yes");
+  } else if (x < 0) {
+    x = 0;
+  } else {
+    x = 1;
+  }
+  do { x = x - 1; } while (x > 0);
+  for (x = 0; x < 3; x++) { y[x] = arr[x]; }
+  while (x) {
+    if (x == 2) break;
+    x--;
+    continue;
+  }
+  return 0;
+}
+'''
+
+
+def test_token_arrays_match_ply_lexer_on_every_construct():
+    tokens = frontend.tokenize_all(GRAMMAR.encode())
+    assert [tuple(getattr(tok, a) for a in ('type', 'value', 'lineno'))
+            for tok in map(tokens.token, range(len(tokens)))] == ply_tokens(GRAMMAR)
+
+
+
+NON_ASCII = 'int café = 1;\nint x = \u0663;\nint y = 2 é€;\nint main() {\n  printstr("ü");\n  // ß\n}\n'
+
+
+def test_token_arrays_match_ply_lexer_on_non_ascii(capsys):
+    expected = ply_tokens(NON_ASCII)
+    ply_errors = capsys.readouterr().out
+    tokens = frontend.tokenize_all(NON_ASCII.encode())
+    assert [tuple(getattr(tok, a) for a in ('type', 'value', 'lineno'))
+            for tok in map(tokens.token, range(len(tokens)))] == expected
+    # one error per illegal character, however many bytes it takes
+    assert capsys.readouterr().out == ply_errors == "Illegal character 'é'\nIllegal character '€'\n"
+    assert frontend.parse(NON_ASCII) == ply_parse(NON_ASCII)
+
+def test_parse_tokens_matches_ply_parser_on_every_construct():
+    tree = frontend.parse(GRAMMAR)
+    expected = ply_parse(GRAMMAR)
+    assert tree == expected
+    assert lines(tree) == lines(expected)
+    used = {type(n) for n in nodes.walk(tree)}
+    assert {cls for cls in vars(nodes).values()
+            if isinstance(cls, type) and issubclass(cls, nodes.Node) and cls is not nodes.Node} <= used
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '}',
+    'int main() {\n  int x\n  x = 1;\n}\n',
+    'int main() {\n  x = (1 + ;\n}\n',
+    'int main() {\n  x = 1;\n',
+    'int main() {\n  if (x) else x = 1;\n}\n',
+])
+def test_syntax_errors_match_ply_parser_anywhere(text):
+    with pytest.raises(frontend.ParseException) as ply_error:
+        ply_parse(text)
+    with pytest.raises(frontend.ParseException) as error:
+        frontend.parse(text)
+    assert str(error.value) == str(ply_error.value)
+
+
+def test_production_warm_start_skips_reflection(tmp_path, monkeypatch):
+    monkeypatch.setenv('CC_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(frontend, 'production', True)
+    frontend.build_lexer()
+    frontend.build_parser()
+
+    def reflect(self):
+        raise AssertionError('reflected on a warm start')
+    monkeypatch.setattr(frontend.lex.LexerReflect, 'get_all', reflect)
+    monkeypatch.setattr(frontend.yacc.ParserReflect, 'get_all', reflect)
+    lexer = frontend.build_lexer()
+    parser = frontend.build_parser()
+    text = example('while.c')
+    assert repr(parser.parse(text, lexer=lexer)) == repr(ply_parse(text))
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+WHILE = os.path.join(ROOT, 'examples', 'while.c')
+
+
+def run_main(*args, cwd):
+    return subprocess.run([sys.executable, '-W', 'ignore', MAIN, *args], cwd=cwd,
+                          capture_output=True, text=True, env=os.environ)
+
+
+def test_time_phases_before_the_files(tmp_path):
+    result = run_main('--time-phases', WHILE, 'out.s', cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / 'out.s').exists()
+    assert 'codegen' in result.stderr
+
+
+def test_time_phases_json(tmp_path):
+    result = run_main('--time-phases-json', 'phases.json', WHILE, 'out.s', cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    report = json.loads((tmp_path / 'phases.json').read_text())
+    assert 'codegen' in [p['phase'] for p in report['phases']]
+
+
+def test_stream_output_matches_a_normal_compile(tmp_path):
+    for name in ('while.c', 'quick_sort.c'):
+        source = os.path.join(ROOT, 'examples', name)
+        result = run_main('--no-timestamp', source, 'whole.s', cwd=tmp_path)
+        assert result.returncode == 0, result.stderr
+        result = run_main('--no-timestamp', '--stream', source, 'stream.s', cwd=tmp_path)
+        assert result.returncode == 0, result.stderr
+        assert (tmp_path / 'stream.s').read_text() == (tmp_path / 'whole.s').read_text()
+
+
+def test_cached_batch_picks_up_edited_sources(tmp_path, monkeypatch):
+    monkeypatch.setenv('CC_CACHE_DIR', str(tmp_path / 'cache'))
+    for name in ('while.c', 'quick_sort.c'):
+        with open(os.path.join(ROOT, 'examples', name)) as f:
+            (tmp_path / name).write_text(f.read())
+    edited = tmp_path / 'while.c'
+    for jobs in ('1', '2'):
+        result = run_main('--batch', '--cache', '-j', jobs, 'while.c', 'quick_sort.c', cwd=tmp_path)
+        assert result.returncode == 0, result.stderr
+        before = (tmp_path / 'while.s').read_text()
+        edited.write_text(edited.read_text().replace('int main', f'int unused{jobs};\nint main', 1))
+        result = run_main('--batch', '--cache', '-j', jobs, 'while.c', 'quick_sort.c', cwd=tmp_path)
+        assert result.returncode == 0, result.stderr
+        after = (tmp_path / 'while.s').read_text()
+        assert after != before
+        result = run_main('--no-timestamp', 'while.c', 'fresh.s', cwd=tmp_path)
+        assert (tmp_path / 'fresh.s').read_text() == after
+
+
+def test_stream_reads_crlf_sources(tmp_path):
+    with open(WHILE, 'rb') as f:
+        (tmp_path / 'crlf.c').write_bytes(f.read().replace(b'\n', b'\r\n'))
+    result = run_main('--no-timestamp', WHILE, 'lf.s', cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    result = run_main('--no-timestamp', '--stream', 'crlf.c', 'crlf.s', cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert 'Illegal character' not in result.stdout
+    lf = (tmp_path / 'lf.s').read_text().split('\n', 1)[1]
+    assert (tmp_path / 'crlf.s').read_text().split('\n', 1)[1] == lf
@@ -0,0 +1,98 @@
+import datetime
+import io
+import itertools
+
+import pytest
+
+import backend
+import compiler
+import frontend
+import nodes
+
+BEFORE = 'int f() {\n  return 1;\n}\nint main() {\n  break;\n}\n'
+AFTER = 'int f() {\n  int a;\n  a = 2;\n  return 1;\n}\nint main() {\n  break;\n}\n'
+
+
+def lines(tree):
+    return [(type(n).__name__, n.lineno) for n in nodes.walk(tree) if isinstance(n, nodes.Node)]
+
+
+def test_reused_unit_reports_its_new_line():
+    unit_cache = frontend.UnitCache()
+    fun_cache = backend.FunctionCache()
+    for source, line in ((BEFORE, 5), (AFTER, 7)):
+        with pytest.raises(Exception, match=f'break outside of a loop at line {line}'):
+            compiler.compile_string(source, fun_cache=fun_cache, unit_cache=unit_cache)
+
+
+def test_reused_units_match_a_fresh_parse():
+    unit_cache = frontend.UnitCache()
+    frontend.parse(BEFORE, unit_cache=unit_cache)
+    stats = {}
+    cached = frontend.parse(AFTER, stats=stats, unit_cache=unit_cache)
+    assert stats['units_reused'] == 1
+    fresh = frontend.parse(AFTER)
+    assert cached == fresh
+    assert lines(cached) == lines(fresh)
+    # the cached entry itself keeps its original lines
+    assert lines(frontend.parse(BEFORE, unit_cache=unit_cache)) == lines(frontend.parse(BEFORE))
+
+
+UNITS = [
+    '# include <stdio.h>\nint a;',
+    '\nint b[2] = {1, 2} /* not yet } */ ;',
+    "\nchar c = '}';",
+    '\n/* { an open brace in a comment */\nint f(int n) {\n  printstr("{;}");\n'
+    '  if (n > 0) {\n    return n; // }\n  }\n  return 0;\n}',
+    '\nint main() {\n  a = f(b[1]);\n}',
+]
+TRAILER = '\n// trailing }\n'
+SOURCE = ''.join(UNITS) + TRAILER
+
+
+def test_split_units_boundaries():
+    ends = list(itertools.accumulate(len(unit) for unit in UNITS))
+    assert list(frontend.split_units(SOURCE)) == ends
+    assert list(frontend.split_units(SOURCE.encode())) == ends
+    assert list(frontend.split_units('')) == []
+    assert list(frontend.split_units('int f() {\n  return 1;\n}')) == [len('int f() {\n  return 1;\n}')]
+
+
+@pytest.mark.parametrize('as_input', [str, str.encode, 'mmap'])
+def test_iter_units_matches_a_whole_parse(as_input, tmp_path):
+    if as_input == 'mmap':
+        path = tmp_path / 'units.c'
+        path.write_text(SOURCE)
+        text = compiler.map_source(str(path))
+    else:
+        text = as_input(SOURCE)
+    units = list(frontend.iter_units(text))
+    whole = frontend.parse(SOURCE)
+    assert units == whole
+    assert lines(units) == lines(whole)
+
+
+@pytest.mark.parametrize('source', ['', '// nothing but a comment\n'])
+def test_iter_units_of_an_empty_file_fails_like_parse(source):
+    with pytest.raises(frontend.ParseException) as whole:
+        frontend.parse(source)
+    with pytest.raises(frontend.ParseException) as units:
+        list(frontend.iter_units(source))
+    assert str(units.value) == str(whole.value)
+
+
+@pytest.mark.parametrize('timestamp', [False, True])
+def test_generate_stream_writes_what_generate_does(timestamp, monkeypatch):
+    class Frozen(datetime.datetime):
+        @classmethod
+        def now(cls):
+            return cls(2000, 1, 1)
+    monkeypatch.setattr(backend.datetime, 'datetime', Frozen)
+
+    instructions = backend.generate(frontend.parse(SOURCE))
+    expected = io.StringIO()
+    backend.write(instructions, expected, timestamp)
+    streamed = io.StringIO()
+    count = backend.CodeGen().generate_stream(frontend.iter_units(SOURCE), streamed, timestamp)
+    assert streamed.getvalue() == expected.getvalue()
+    assert count == backend.CodeGen().stats(instructions)['instructions']
@@ -0,0 +1,48 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """Collects wall/CPU time per compile phase plus named counters."""
+
+    def __init__(self):
+        self.phases = []
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append({'phase': name,
+                                'wall': time.perf_counter() - wall,
+                                'cpu': time.process_time() - cpu})
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def as_dict(self):
+        return {'phases': self.phases,
+                'total': {'wall': sum(p['wall'] for p in self.phases),
+                          'cpu': sum(p['cpu'] for p in self.phases)},
+                'counters': self.counters}
+
+    def report(self, dest='-'):
+        # '-' prints a table to stderr, anything else is a JSON file name
+        if dest != '-':
+            with open(dest, 'w') as f:
+                json.dump(self.as_dict(), f, indent=2)
+            return
+
+        out = sys.stderr
+        out.write(f"{'phase':<12}{'wall ms':>10}{'cpu ms':>10}\n")
+        for p in self.phases:
+            out.write(f"{p['phase']:<12}{p['wall'] * 1000:>10.2f}{p['cpu'] * 1000:>10.2f}\n")
+        total = self.as_dict()['total']
+        out.write(f"{'total':<12}{total['wall'] * 1000:>10.2f}{total['cpu'] * 1000:>10.2f}\n")
+        for name, value in self.counters.items():
+            out.write(f'{name:<20}{value:>10}\n')
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import sys
+import time
+
+import backend
+import frontend
+from cache import atomic_path
+from compiler import compile_string
+
+# seconds between looks at the source file
+POLL_INTERVAL = 0.2
+
+
+def rebuild(source, output, text, unit_cache, fun_cache, timestamp=True):
+    start = time.perf_counter()
+    try:
+        asm = compile_string(text, filename=source, timestamp=timestamp,
+                             unit_cache=unit_cache, fun_cache=fun_cache)
+    except Exception as e:
+        print(f'{source}: {e}', file=sys.stderr)
+        return False
+    with atomic_path(output) as tmp:
+        with open(tmp, 'w') as f:
+            f.write(asm)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f'{source} -> {output} ({elapsed:.1f} ms)', file=sys.stderr)
+    return True
+
+
+def watch(source, output, interval=POLL_INTERVAL, timestamp=True):
+    """Recompile `source` into `output` every time it changes, until interrupted.
+
+    The parser stays warm between builds, and top-level units and functions
+    that did not change are taken from in-memory caches.  The output is
+    replaced atomically and left alone when a build fails.
+    """
+    frontend.warm_up()
+    unit_cache = frontend.UnitCache()
+    fun_cache = backend.FunctionCache()
+
+    seen = None
+    built = None
+    while True:
+        try:
+            st = os.stat(source)
+            stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            stamp = None
+        if stamp is not None and stamp != seen:
+            seen = stamp
+            try:
+                with open(source, 'rb') as f:
+                    text = f.read()
+            except OSError as e:
+                print(f'{source}: {e}', file=sys.stderr)
+            else:
+                # editors often touch the file without changing it
+                digest = hashlib.sha256(text).digest()
+                if digest != built and rebuild(source, output, text, unit_cache, fun_cache, timestamp):
+                    built = digest
+        time.sleep(interval)